@@ -0,0 +1,6 @@
+"""
+Benchmarks de la couche modèle (Call, Operator, Coordinator)
+à lancer contre un redis-server local, depuis la racine du projet :
+    python -m app.bench            # toutes les opérations, résultat JSON
+    python -m app.bench.liste
+"""
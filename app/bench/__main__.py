@@ -0,0 +1,162 @@
+"""
+Benchmark de la couche modèle : débit, latence (p50, p99, max) et allers-retours Redis
+par opération, résultat en JSON pour suivre les régressions d'une version à l'autre.
+
+    python -m app.bench --appels 10000 --operateurs 100 --sortie bench.json
+
+Opérations mesurées : création d'appels et d'opérateurs, Call.list(),
+Call.get_instance_by_id(), Coordinator.assign_all() et Call.end().
+Le benchmark utilise le redis-server configuré (REDIS_HOST, ...) ; s'il ne répond pas,
+ou avec --fakeredis, un serveur fakeredis en mémoire (pip install "fakeredis[lua]").
+Il supprime tous les appels et opérateurs et ajoute les appels terminés
+au stream archive_appels : à lancer sur une base de test (REDIS_DB).
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime
+
+import redis
+
+from app.bench.liste import CompteurAllersRetours, ConnexionComptee
+from app.models import Call, Coordinator, Operator, charger_scripts, configure, get_connexion
+
+
+def choisir_serveur(fakeredis_force=False):
+    """
+    Configure la connexion partagée avec une connexion comptée,
+    retourne ("redis" ou "fakeredis", classe de connexion comptée)
+    """
+    if not fakeredis_force:
+        configure(connection_class=ConnexionComptee)
+        try:
+            get_connexion().ping()
+            return "redis", ConnexionComptee
+        except redis.exceptions.ConnectionError:
+            print("redis-server injoignable, utilisation de fakeredis", file=sys.stderr)
+
+    import fakeredis
+
+    # FakeConnection (fakeredis < 2.30) a été renommée FakeRedisConnection
+    connexion_fake = getattr(fakeredis, "FakeRedisConnection", None) or fakeredis.FakeConnection
+
+    class ConnexionFakeComptee(CompteurAllersRetours, connexion_fake):
+        pass
+
+    configure(connection_class=ConnexionFakeComptee, server=fakeredis.FakeServer())
+    return "fakeredis", ConnexionFakeComptee
+
+
+def resume(durees, allers_retours):
+    """
+    Résume les durées (secondes) d'une opération répétée
+    """
+    valeurs = sorted(durees)
+    total = sum(valeurs)
+    return {
+        "nombre": len(valeurs),
+        "duree_totale": total,
+        "debit": len(valeurs) / total if total else None,
+        "latence_p50": valeurs[len(valeurs) // 2],
+        "latence_p99": valeurs[min(len(valeurs) - 1, int(len(valeurs) * 0.99))],
+        "latence_max": valeurs[-1],
+        "allers_retours_par_operation": allers_retours / len(valeurs),
+    }
+
+
+class Mesures:
+    """
+    Durées et allers-retours de chaque exécution, par opération
+    """
+
+    def __init__(self, connexion_comptee):
+        self.connexion_comptee = connexion_comptee
+        self.durees = {}
+        self.allers_retours = {}
+
+    def mesurer(self, operation, fonction, *arguments):
+        allers_retours = self.connexion_comptee.allers_retours
+        debut = time.perf_counter()
+        resultat = fonction(*arguments)
+        self.durees.setdefault(operation, []).append(time.perf_counter() - debut)
+        self.allers_retours[operation] = (
+            self.allers_retours.get(operation, 0) + self.connexion_comptee.allers_retours - allers_retours
+        )
+        return resultat
+
+    def resultats(self):
+        return {
+            operation: resume(durees, self.allers_retours[operation])
+            for operation, durees in self.durees.items()
+        }
+
+
+def scenario(mesures, nombre_appels, nombre_operateurs, repetitions_liste):
+    appels = {}
+    for numero in range(nombre_appels):
+        appel = mesures.mesurer("creation_appel", Call, "06{:08d}".format(numero))
+        appels[str(appel._id)] = appel
+
+    for numero in range(nombre_operateurs):
+        mesures.mesurer("creation_operateur", Operator, "Prenom{}".format(numero), "Nom{}".format(numero))
+
+    for _ in range(repetitions_liste):
+        mesures.mesurer("list", Call.list)
+
+    identifiants = list(appels)
+    for _ in range(nombre_appels):
+        mesures.mesurer("get_instance_by_id", Call.get_instance_by_id, random.choice(identifiants))
+
+    # Chaque tour affecte au plus un appel par opérateur, puis termine ces appels
+    # pour libérer les opérateurs, jusqu'à vider la file d'attente
+    while True:
+        affectations = mesures.mesurer("assign_all", Coordinator.assign_all)
+        if not affectations:
+            break
+        for appel_id, operateur_id, attente in affectations:
+            mesures.mesurer("end", appels[appel_id].end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de Call, Operator et Coordinator")
+    parser.add_argument("--appels", type=int, default=10000, help="nombre d'appels créés")
+    parser.add_argument("--operateurs", type=int, default=100, help="nombre d'opérateurs créés")
+    parser.add_argument("--repetitions-liste", type=int, default=5, help="nombre d'appels à Call.list()")
+    parser.add_argument("--fakeredis", action="store_true", help="utiliser fakeredis même si redis-server répond")
+    parser.add_argument("--sortie", help="fichier JSON du résultat (sortie standard par défaut)")
+    arguments = parser.parse_args()
+
+    serveur, connexion_comptee = choisir_serveur(arguments.fakeredis)
+    charger_scripts(get_connexion())
+    Call.destroy_all()
+    Operator.destroy_all()
+
+    mesures = Mesures(connexion_comptee)
+    try:
+        scenario(mesures, arguments.appels, arguments.operateurs, arguments.repetitions_liste)
+    finally:
+        Call.destroy_all()
+        Operator.destroy_all()
+
+    resultat = json.dumps({
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "serveur": serveur,
+        "parametres": {
+            "appels": arguments.appels,
+            "operateurs": arguments.operateurs,
+            "repetitions_liste": arguments.repetitions_liste,
+        },
+        "operations": mesures.resultats(),
+    }, indent=2)
+
+    if arguments.sortie:
+        with open(arguments.sortie, "w") as fichier:
+            fichier.write(resultat + "\n")
+    else:
+        print(resultat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Benchmark : débit de création et de mise à jour d'appels,
+version synchrone (Call) contre version asyncio (AsyncCall).
+
+    python -m app.bench.asynchrone
+"""
+import asyncio
+import time
+
+from app.models import Call
+from app.models.asynchrone import AsyncCall
+
+
+def scenario_synchrone(nombre):
+    # Création puis mise à jour de la description, un appel après l'autre
+    for numero in range(nombre):
+        appel = Call("06{:08d}".format(numero))
+        appel.description = "appel {}".format(numero)
+
+
+async def scenario_asynchrone(nombre, concurrence):
+    # Même scénario, avec au plus concurrence appels en cours en même temps
+    semaphore = asyncio.Semaphore(concurrence)
+
+    async def un_appel(numero):
+        async with semaphore:
+            appel = await AsyncCall.create("06{:08d}".format(numero))
+            await appel.set_description("appel {}".format(numero))
+
+    await asyncio.gather(*(un_appel(numero) for numero in range(nombre)))
+
+
+def main(nombre=5000, concurrence=100):
+    Call.destroy_all()
+    debut = time.perf_counter()
+    scenario_synchrone(nombre)
+    duree_synchrone = time.perf_counter() - debut
+
+    Call.destroy_all()
+    debut = time.perf_counter()
+    asyncio.run(scenario_asynchrone(nombre, concurrence))
+    duree_asynchrone = time.perf_counter() - debut
+    Call.destroy_all()
+
+    print("{:>12} {:>10} {:>14}".format("mode", "durée (s)", "appels/s"))
+    print("{:>12} {:>10.3f} {:>14.0f}".format("synchrone", duree_synchrone, nombre / duree_synchrone))
+    print("{:>12} {:>10.3f} {:>14.0f}".format("asyncio", duree_asynchrone, nombre / duree_asynchrone))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Microbenchmark : temps CPU par appel listé,
+décodage des bytes dans les modèles (ancienne méthode) contre
+connexion decode_responses=True + Call.hydrater.
+
+    python -m app.bench.decodage
+"""
+import time
+
+import redis
+
+from app.models import Call, parametres
+from app.models.stockage import decoder_appel
+
+
+def lister_en_bytes(connexion, identifiants, taille_lot=1000):
+    # Ancienne méthode : réponses en bytes, décodées champ par champ
+    appels = []
+    for debut in range(0, len(identifiants), taille_lot):
+        lot = identifiants[debut:debut + taille_lot]
+        pipeline = connexion.pipeline(transaction=False)
+        for identifiant in lot:
+            pipeline.hgetall(Call.cle(identifiant.decode()))
+        for identifiant, details_appel in zip(lot, pipeline.execute()):
+            details_appel = decoder_appel({key.decode(): value.decode() for key, value in details_appel.items()})
+            details_appel["id"] = identifiant.decode()
+            details_appel["status"] = int(details_appel["status"])
+            details_appel["operator_id"] = int(details_appel["operator_id"])
+            appels.append(details_appel)
+    return appels
+
+
+def mesurer(fonction):
+    debut = time.process_time()
+    resultat = fonction()
+    return resultat, time.process_time() - debut
+
+
+def main(nombre=100000):
+    Call.destroy_all()
+    Call.create_many("06{:08d}".format(numero) for numero in range(nombre))
+
+    options = parametres()
+    options["decode_responses"] = False
+    connexion_bytes = redis.Redis(connection_pool=redis.ConnectionPool(**options))
+    identifiants = list(connexion_bytes.smembers("identifiants_appels_entrants"))
+
+    appels_bytes, cpu_bytes = mesurer(lambda: lister_en_bytes(connexion_bytes, identifiants))
+    appels_decodes, cpu_decodes = mesurer(Call.list)
+    assert len(appels_bytes) == len(appels_decodes) == nombre
+
+    print("{:>22} {:>10} {:>16}".format("méthode", "CPU (s)", "µs CPU / appel"))
+    print("{:>22} {:>10.3f} {:>16.2f}".format("bytes + .decode()", cpu_bytes, cpu_bytes / nombre * 1e6))
+    print("{:>22} {:>10.3f} {:>16.2f}".format("decode_responses", cpu_decodes, cpu_decodes / nombre * 1e6))
+
+    Call.destroy_all()
+
+
+if __name__ == '__main__':
+    main()
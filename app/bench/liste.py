@@ -0,0 +1,53 @@
+"""
+Benchmark de Call.list() : nombre d'allers-retours Redis et durée
+en fonction du nombre d'appels enregistrés.
+
+    python -m app.bench.liste
+"""
+import time
+
+import redis
+
+from app.models import Call, configure
+
+
+class CompteurAllersRetours:
+    """
+    À placer avant une classe de connexion redis-py : compte les envois vers le serveur,
+    une commande seule ou un pipeline complet = un aller-retour
+    """
+    allers_retours = 0
+
+    def send_packed_command(self, command, check_health=True):
+        type(self).allers_retours += 1
+        return super().send_packed_command(command, check_health)
+
+
+class ConnexionComptee(CompteurAllersRetours, redis.Connection):
+    """
+    Connexion redis-py qui compte ses allers-retours
+    """
+
+
+def main(tailles=(100, 1000, 10000)):
+    # Les modèles utilisent la connexion comptée
+    configure(connection_class=ConnexionComptee)
+
+    print("{:>8} {:>14} {:>12}".format("appels", "allers-retours", "durée (s)"))
+    for taille in tailles:
+        Call.destroy_all()
+        Call.create_many("06{:08d}".format(numero) for numero in range(taille))
+
+        ConnexionComptee.allers_retours = 0
+        debut = time.perf_counter()
+        appels = Call.list()
+        duree = time.perf_counter() - debut
+
+        assert len(appels) == taille
+        print("{:>8} {:>14} {:>12.4f}".format(taille, ConnexionComptee.allers_retours, duree))
+
+    Call.destroy_all()
+
+
+if __name__ == '__main__':
+    main()
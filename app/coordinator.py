@@ -0,0 +1,204 @@
+"""
+Coordinateur en continu : affecte les appels dès qu'un appel arrive
+ou qu'un opérateur se libère, sans interroger Redis en boucle.
+
+    python -m app.coordinator
+    python -m app.coordinator --processus 4
+
+Le processus est abonné au canal evenements_coordinateur ; à chaque événement
+il lance Coordinator.assign_partitions() sur ses partitions des files d'attente,
+qui ne traite que les files et les sets d'opérateurs disponibles (un par groupe).
+
+Plusieurs coordinateurs (--processus N, ou plusieurs lancements, sur une ou plusieurs machines)
+se répartissent les partitions des files (REDIS_PARTITIONS_ATTENTE, voir app/models/repartition.py) ;
+quand l'un s'arrête, ses partitions sont reprises par les autres à l'expiration de son bail.
+
+La latence entre la création d'un appel et son affectation est mesurée :
+un résumé est affiché et enregistré dans le hash Redis metriques_coordinateur :{nom},
+avec la profondeur de la file d'attente et l'attente de l'appel le plus ancien.
+
+Avec --prometheus FICHIER, les opérations des modèles sont instrumentées et leurs
+statistiques écrites au format texte de Prometheus dans FICHIER à chaque publication
+(à lire par exemple avec le textfile collector de node_exporter) ;
+avec plusieurs processus, chacun écrit son fichier (coordinateur.prom -> coordinateur-1.prom, ...).
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+
+from app.models import (
+    Call, Coordinator, activer_instrumentation, charger_scripts, get_connexion, texte_prometheus,
+)
+from app.models.evenements import AbonnementEvenements
+from app.models.repartition import DUREE_BAIL, Bail
+
+
+class MesureLatence:
+    """
+    Latences d'affectation des derniers appels (fenêtre glissante de taille_max valeurs)
+    """
+
+    def __init__(self, taille_max=10000):
+        self.valeurs = deque(maxlen=taille_max)
+        self.total = 0
+
+    def ajouter(self, attente):
+        self.valeurs.append(attente)
+        self.total += 1
+
+    def resume(self):
+        """
+        Retourne le nombre total d'affectations et les percentiles de latence (secondes)
+        """
+        if not self.valeurs:
+            return {"affectations": self.total}
+
+        valeurs = sorted(self.valeurs)
+        return {
+            "affectations": self.total,
+            "latence_p50": valeurs[len(valeurs) // 2],
+            "latence_p99": valeurs[min(len(valeurs) - 1, int(len(valeurs) * 0.99))],
+            "latence_max": valeurs[-1],
+        }
+
+
+def ecrire_prometheus(fichier):
+    # Fichier temporaire puis renommage : le lecteur ne voit jamais un fichier à moitié écrit
+    with open(fichier + ".tmp", "w") as sortie:
+        sortie.write(texte_prometheus())
+    os.replace(fichier + ".tmp", fichier)
+
+
+def boucle(intervalle_metriques=10.0, fichier_prometheus=None, nom=None):
+    """
+    Boucle principale du coordinateur, interrompue par Ctrl+C
+    """
+    if fichier_prometheus is not None:
+        activer_instrumentation()
+    connexion = get_connexion()
+    charger_scripts(connexion)
+    bail = Bail(nom)
+    abonnement = AbonnementEvenements(connexion)
+    latences = MesureLatence()
+    dernier_resume = time.monotonic()
+    # Le bail est renouvelé au moins trois fois par durée de bail, même sans événement
+    timeout = min(intervalle_metriques, DUREE_BAIL / 3)
+
+    try:
+        # Les appels arrivés avant le démarrage sont traités tout de suite
+        evenement = "demarrage"
+        partitions = []
+        while True:
+            # Les partitions sont recalculées à chaque tour : un coordinateur arrivé
+            # ou disparu entre-temps en prend ou en laisse
+            nouvelles_partitions = bail.partitions()
+            if nouvelles_partitions != partitions:
+                print("Partitions de {} : {}".format(bail.nom, nouvelles_partitions))
+                # Des partitions reprises peuvent avoir des appels en attente
+                evenement = evenement or "repartition"
+                partitions = nouvelles_partitions
+
+            if evenement is not None:
+                for appel_id, operateur_id, attente in Coordinator.assign_partitions(partitions):
+                    latences.ajouter(attente)
+
+            if time.monotonic() - dernier_resume >= intervalle_metriques:
+                publier_metriques(connexion, bail.nom, latences, len(partitions), fichier_prometheus)
+                dernier_resume = time.monotonic()
+
+            # Le timeout permet de renouveler le bail et de publier les métriques même sans activité
+            evenement = abonnement.attendre(timeout)
+    finally:
+        abonnement.fermer()
+        bail.liberer()
+
+
+def publier_metriques(connexion, nom, latences, nombre_partitions, fichier_prometheus=None):
+    """
+    Enregistre et affiche le résumé des latences du coordinateur nom
+    """
+    resume = latences.resume()
+    resume["partitions"] = nombre_partitions
+    # Profondeur de la file et attente du plus ancien appel encore en attente (toutes partitions)
+    file_attente = Call.etat_file_attente()
+    resume["file_profondeur"] = file_attente["profondeur"]
+    resume["file_attente_max"] = file_attente["attente_max"]
+    connexion.hset("metriques_coordinateur :{}".format(nom), mapping=resume)
+    print("Métriques :", resume)
+    if fichier_prometheus is not None:
+        ecrire_prometheus(fichier_prometheus)
+
+
+def fichier_processus(fichier, numero):
+    # coordinateur.prom -> coordinateur-1.prom : un fichier par processus
+    if fichier is None:
+        return None
+    base, extension = os.path.splitext(fichier)
+    return "{}-{}{}".format(base, numero, extension)
+
+
+def lancer(intervalle_metriques, fichier_prometheus, nom):
+    # Point d'entrée d'un processus du pool : Ctrl+C arrête proprement chaque processus
+    try:
+        boucle(intervalle_metriques, fichier_prometheus, nom)
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coordinateur d'appels en continu")
+    parser.add_argument(
+        "--intervalle-metriques", type=float, default=10.0,
+        help="secondes entre deux publications des métriques de latence",
+    )
+    parser.add_argument(
+        "--prometheus", metavar="FICHIER",
+        help="instrumenter les modèles et écrire leurs statistiques au format Prometheus dans FICHIER",
+    )
+    parser.add_argument(
+        "--processus", type=int, default=1,
+        help="nombre de processus coordinateurs, qui se répartissent les partitions des files",
+    )
+    parser.add_argument(
+        "--nom",
+        help="nom du coordinateur parmi les coordinateurs actifs (machine:pid par défaut, un seul processus)",
+    )
+    parser.add_argument(
+        "--verbeux", action="store_true",
+        help="afficher chaque affectation et chaque file vide (journal de app.models.coordinator)",
+    )
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if arguments.verbeux else logging.WARNING)
+
+    if arguments.processus <= 1:
+        try:
+            boucle(arguments.intervalle_metriques, arguments.prometheus, arguments.nom)
+        except KeyboardInterrupt:
+            print("Arrêt du coordinateur")
+        return
+
+    # Chaque processus ouvre sa propre connexion (aucune connexion n'est ouverte avant le fork)
+    processus = [
+        multiprocessing.Process(
+            target=lancer,
+            args=(arguments.intervalle_metriques, fichier_processus(arguments.prometheus, numero), None),
+        )
+        for numero in range(1, arguments.processus + 1)
+    ]
+    for coordinateur in processus:
+        coordinateur.start()
+    try:
+        for coordinateur in processus:
+            coordinateur.join()
+    except KeyboardInterrupt:
+        # Ctrl+C est aussi reçu par les processus, qui libèrent leur bail
+        for coordinateur in processus:
+            coordinateur.join()
+    print("Arrêt des coordinateurs")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,12 @@
 from models import *
 
 print("-----------")
+# Chargement des scripts Lua dans le cache du serveur Redis
+charger_scripts(get_connexion())
+
 # On supprime tous les appels et les opérateurs déjà enregistrés dans Redis 
-Call.destroy_all()
-Operator.destroy_all()
+print("appels supprimés :",Call.destroy_all())
+print("opérateurs supprimés :",Operator.destroy_all())
 
 
 # Création d'un appel et d'un opérateur")
@@ -15,12 +18,12 @@ print("data appel :",appel.data())
 print("data operator",operateur.data())
 
 coordinator = Coordinator()
-coordinator.assign_all()
+for appel_id, operateur_id, attente in coordinator.assign_all():
+    print(f"Appel {appel_id} assigné à l'opérateur {operateur_id}")
 
 appel.description = "test"
 
+# Fin de l'appel : l'opérateur est libéré et l'appel archivé
 appel.end()
-
-# Faire une fonction qui met fin à l'appel :
-#     operateur : status = 0 
-#     operateur : call_id = 0
\ No newline at end of file
+print("data operator",operateur.data())
+print("archive",Call.archive())
@@ -0,0 +1,51 @@
+"""
+Migration des hashs des appels vers la disposition compacte (ou retour à la classique),
+avec un rapport mémoire avant / après.
+
+    python -m app.migrer_stockage                 # classique -> compacte
+    python -m app.migrer_stockage --classique     # compacte -> classique
+
+Le rapport compare MEMORY USAGE (moyenne sur un échantillon d'appels) et l'encodage
+des hashs (listpack ou hashtable) dans les deux dispositions.
+Ensuite, lancer tous les processus avec REDIS_STOCKAGE_COMPACT=1 (ou 0 pour la classique).
+"""
+import argparse
+
+from app.models import Call, configure_stockage
+
+
+def afficher(titre, rapport):
+    print(titre)
+    print("  disposition      :", rapport["disposition"])
+    print("  appels           :", rapport["appels"])
+    print("  octets par appel : {:.1f}".format(rapport["octets_par_appel"]))
+    print("  total estimé     : {:.1f} Mo".format(rapport["octets_estimes"] / 1e6))
+    print("  encodages        :", rapport["encodages"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migration de la disposition des hashs des appels")
+    parser.add_argument(
+        "--classique", action="store_true",
+        help="revenir à la disposition classique au lieu de passer à la compacte",
+    )
+    parser.add_argument("--echantillon", type=int, default=1000, help="appels mesurés par MEMORY USAGE")
+    parser.add_argument("--taille-lot", type=int, default=1000, help="appels migrés par MULTI/EXEC")
+    arguments = parser.parse_args()
+    compacte = not arguments.classique
+
+    configure_stockage(not compacte)
+    avant = Call.memoire(arguments.echantillon)
+    afficher("Avant", avant)
+
+    nombre = Call.migrer_stockage(compacte, arguments.taille_lot)
+    print("{} appels migrés".format(nombre))
+
+    apres = Call.memoire(arguments.echantillon)
+    afficher("Après", apres)
+    if avant["octets_par_appel"]:
+        print("Gain : {:.0%}".format(1 - apres["octets_par_appel"] / avant["octets_par_appel"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,10 @@
 from .call import *
 from .operator import *
-from .coordinator import *
\ No newline at end of file
+from .coordinator import *
+from .scripts import *
+from .connexion import backend, configure, get_connexion, get_connexion_async, parametres, reinitialiser_memoire
+from .cache import activer_cache, desactiver_cache, statistiques_cache
+from .session import Session
+from .stockage import configure_partitions, configure_stockage
+from .instrumentation import activer_instrumentation, desactiver_instrumentation, statistiques_instrumentation, texte_prometheus
+from .statistiques import reinitialiser_statistiques, statistiques_appels, statistiques_operateurs
\ No newline at end of file
@@ -0,0 +1,617 @@
+"""
+Version asyncio des modèles, sur redis.asyncio.
+
+AsyncCall, AsyncOperator et AsyncCoordinator utilisent les mêmes clés Redis
+que Call, Operator et Coordinator : les deux versions peuvent travailler
+sur les mêmes données. Un constructeur Python ne pouvant pas être asynchrone,
+la création passe par AsyncCall.create() / AsyncOperator.create(), et les
+setters sont remplacés par des méthodes set_*() à attendre avec await.
+
+    appel = await AsyncCall.create("0607080910")
+    await appel.set_description("Bonjour, ...")
+    await AsyncCoordinator.assign_all()
+    await appel.end()
+
+Les méthodes de Call et Operator qui envoient des commandes Redis sont redéfinies
+en coroutines ; celles qui n'ont pas de version asyncio (migrations, archive, sessions...)
+lèvent une exception au lieu de bloquer la boucle d'événements : utiliser Call / Operator.
+"""
+import heapq
+import itertools
+import time
+
+from .cache import invalider_local
+from .call import FILES_APPELS, INDEX_STATUS_APPELS, Call
+from .connexion import get_connexion_async
+from .coordinator import Coordinator
+from .operator import GROUPES_OPERATEURS, INDEX_STATUS_OPERATEURS, Operator
+from .scripts import (
+    AffectationImpossible, FinAppelImpossible, ResultatAffectation, ResultatFinAppel,
+    affecter_appel_async, retirer_plus_ancien_async, terminer_appel_async,
+)
+from .stockage import champ, nombre_partitions
+
+
+def _bloquante(nom):
+    # Remplace une méthode synchrone héritée : l'appeler bloquerait la boucle d'événements
+    def methode(*args,**kwargs):
+        raise Exception("{} n'a pas de version asyncio : utiliser la version synchrone hors de la boucle d'événements.".format(nom))
+    return staticmethod(methode)
+
+
+class AsyncCall(Call):
+    """
+    Appel manipulé avec asyncio, voir Call pour la description des attributs
+    """
+
+    def __post_init__(self):
+        # L'enregistrement dans Redis est fait par AsyncCall.create()
+        return self
+
+    # ------------------------------
+    # Propriétés en lecture seule : l'écriture passe par les méthodes set_*
+    # ------------------------------
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def operator_id(self):
+        return self._operator_id
+
+    @property
+    def description(self):
+        return self._description
+
+    @property
+    def priority(self):
+        return self._priority
+
+    # ------------------------------
+    # Méthodes de l'objet
+    # ------------------------------
+
+    async def set_status(self,value):
+        self._status = value
+        async with get_connexion_async().pipeline(transaction=True) as pipeline:
+            self._ecrire_status(pipeline,value)
+            await pipeline.execute()
+        invalider_local([Call.cle(self._id)])
+        return self
+
+    async def set_operator_id(self,value):
+        self._operator_id = value
+        await get_connexion_async().hset(Call.cle(self._id),champ("operator_id"),value)
+        invalider_local([Call.cle(self._id)])
+        return self
+
+    async def set_description(self,value):
+        self._description = value
+        await get_connexion_async().hset(Call.cle(self._id),champ("description"),value)
+        invalider_local([Call.cle(self._id)])
+        return self
+
+    async def set_priority(self,value):
+        self._priority = Call._verifier_priorite(value)
+        async with get_connexion_async().pipeline(transaction=True) as pipeline:
+            pipeline.hset(Call.cle(self._id),champ("priority"),self._priority)
+            pipeline.zadd(self._cle_index(0),{self._id:self._score_attente()},xx=True)
+            await pipeline.execute()
+        invalider_local([Call.cle(self._id)])
+        return self
+
+    async def data(self):
+        """
+        Retourne les caractéristiques de l'appel
+        """
+        details_appel = await AsyncCall.data_by_id(self._id)
+        details_appel['id'] = self._id
+        details_appel['duree'] = self.duree
+        return details_appel
+
+    async def destroy(self):
+        """
+        Supprime un appel
+        """
+        async with get_connexion_async().pipeline(transaction=True) as pipeline:
+            pipeline.srem("identifiants_appels_entrants",self._id)
+            pipeline.delete(Call.cle(self._id))
+            for status in INDEX_STATUS_APPELS:
+                pipeline.zrem(self._cle_index(status),self._id)
+            await pipeline.execute()
+        invalider_local([Call.cle(self._id)])
+
+    async def end(self):
+        """
+        Met fin à l'appel et l'archive (même script Lua que Call.end())
+        """
+        while True:
+            # Mêmes lectures que Call.lire_fin, puis les clés du script (Call.preparer_fin)
+            operateur_id, file = await get_connexion_async().hmget(Call.cle(self._id),champ("operator_id"),champ("queue"))
+            operateur_id = operateur_id or "0"
+            skills = await get_connexion_async().hget(Operator.cle(operateur_id),"skills") if operateur_id != "0" else None
+            resultat = await terminer_appel_async(
+                get_connexion_async(),*Call.preparer_fin(self._id,operateur_id,file or "",skills or "")
+            )
+            if resultat != ResultatFinAppel.DONNEES_MODIFIEES :
+                break
+        if resultat != ResultatFinAppel.TERMINE :
+            raise FinAppelImpossible(resultat)
+
+        self._status = 2
+        return self
+
+    # ------------------------------
+    # Méthodes statiques
+    # ------------------------------
+
+    @staticmethod
+    async def create(phone_number,priority=0,queue=""):
+        """
+        Crée un appel et l'enregistre dans Redis (INCR puis un MULTI/EXEC)
+        """
+        identifiant = await get_connexion_async().incr("compteur_appels_entrants")
+        appel = AsyncCall(phone_number,id=identifiant,priority=priority,queue=queue)
+        async with get_connexion_async().pipeline(transaction=True) as pipeline:
+            appel._enregistrer(pipeline)
+            await pipeline.execute()
+        return appel
+
+    @staticmethod
+    async def data_by_id(id_call):
+        """
+        Retourne les données d'un appel par id
+        """
+        details_appel = await get_connexion_async().hgetall(Call.cle(id_call))
+        if not details_appel :
+            return details_appel
+        return Call.hydrater(id_call,details_appel)
+
+    @staticmethod
+    async def iter(taille_lot=1000):
+        """
+        Générateur asynchrone parcourant les appels (SSCAN + HGETALL par lots)
+        """
+        lot = []
+        async for identifiant in get_connexion_async().sscan_iter("identifiants_appels_entrants",count=taille_lot):
+            lot.append(identifiant)
+            if len(lot) == taille_lot :
+                for details_appel in await AsyncCall._lire_lot(lot):
+                    yield details_appel
+                lot = []
+
+        if lot :
+            for details_appel in await AsyncCall._lire_lot(lot):
+                yield details_appel
+
+    @staticmethod
+    async def list(taille_lot=1000):
+        """
+        Liste tous les appels ainsi que leurs descriptions
+        """
+        return [details_appel async for details_appel in AsyncCall.iter(taille_lot)]
+
+    @staticmethod
+    async def _lire_lot(identifiants):
+        # Lit les hashs d'un lot d'identifiants en un seul aller-retour
+        async with get_connexion_async().pipeline(transaction=False) as pipeline:
+            for identifiant in identifiants:
+                pipeline.hgetall(Call.cle(identifiant))
+            resultats = await pipeline.execute()
+
+        return [
+            Call.hydrater(identifiant,details_appel)
+            for identifiant, details_appel in zip(identifiants,resultats)
+            if details_appel
+        ]
+
+    @staticmethod
+    async def get_instance_by_id(identifiant):
+        """
+        Retourne un objet AsyncCall pour un identifiant donné
+        """
+        details_appel = await AsyncCall.data_by_id(identifiant)
+        if details_appel :
+            return Call._instance(details_appel,AsyncCall)
+
+        raise Exception("L'appel n'existe pas.")
+
+    @staticmethod
+    async def get_many(identifiants):
+        """
+        Retourne les objets AsyncCall pour plusieurs identifiants en un seul aller-retour,
+        dans le même ordre, avec None pour un appel qui n'existe pas
+        """
+        identifiants = list(identifiants)
+        async with get_connexion_async().pipeline(transaction=False) as pipeline:
+            for identifiant in identifiants:
+                pipeline.hgetall(Call.cle(identifiant))
+            hashs = await pipeline.execute()
+        return [
+            Call._instance(Call.hydrater(identifiant,details_appel),AsyncCall) if details_appel else None
+            for identifiant, details_appel in zip(identifiants,hashs)
+        ]
+
+    @staticmethod
+    async def files():
+        """
+        Retourne les files d'attente connues, la file par défaut "" en premier
+        """
+        return [""] + sorted(await get_connexion_async().smembers(FILES_APPELS))
+
+    @staticmethod
+    async def waiting(limit=None,queue=None):
+        """
+        Liste les appels en attente dans l'ordre où ils seront servis, voir Call.waiting
+        """
+        fin = -1 if limit is None else limit - 1
+        files = await AsyncCall.files() if queue is None else [queue]
+        async with get_connexion_async().pipeline(transaction=False) as pipeline:
+            for file in files:
+                for cle in Call.cles_attente(file):
+                    pipeline.zrange(cle,0,fin,withscores=True)
+            resultats = await pipeline.execute()
+
+        appels = heapq.merge(*resultats,key=lambda appel: appel[1])
+        identifiants = [identifiant for identifiant, score in itertools.islice(appels,limit)]
+        return await AsyncCall._lire_lot(identifiants)
+
+    @staticmethod
+    async def par_status(status,limit=None):
+        """
+        Liste les appels d'un status donné, du plus ancien au plus récent (au plus limit appels)
+        """
+        if int(status) == 0 :
+            return await AsyncCall.waiting(limit)
+
+        fin = -1 if limit is None else limit - 1
+        identifiants = await get_connexion_async().zrange(INDEX_STATUS_APPELS[int(status)],0,fin)
+        return await AsyncCall._lire_lot(identifiants)
+
+    @staticmethod
+    async def taken(limit=None):
+        return await AsyncCall.par_status(1,limit)
+
+    @staticmethod
+    async def finished(limit=None):
+        return await AsyncCall.par_status(2,limit)
+
+    @staticmethod
+    async def destroy_all(taille_lot=1000):
+        """
+        Supprime tous les appels (SSCAN puis UNLINK par lots), retourne le nombre d'appels supprimés
+        """
+        nombre = 0
+        lot = []
+        async for identifiant in get_connexion_async().sscan_iter("identifiants_appels_entrants",count=taille_lot):
+            lot.append(Call.cle(identifiant))
+            if len(lot) == taille_lot :
+                nombre += await get_connexion_async().unlink(*lot)
+                lot = []
+        if lot :
+            nombre += await get_connexion_async().unlink(*lot)
+
+        await get_connexion_async().unlink(
+            "identifiants_appels_entrants",
+            *INDEX_STATUS_APPELS.values(),*[cle for file in await AsyncCall.files() for cle in Call.cles_attente(file)],
+            FILES_APPELS,
+        )
+        return nombre
+
+    # Méthodes synchrones sans version asyncio
+    batch = _bloquante("AsyncCall.batch")
+    list_id = _bloquante("AsyncCall.list_id")
+    create_many = _bloquante("AsyncCall.create_many")
+    migrer_compteur = _bloquante("AsyncCall.migrer_compteur")
+    migrer_stockage = _bloquante("AsyncCall.migrer_stockage")
+    memoire = _bloquante("AsyncCall.memoire")
+    list_entring_call = _bloquante("AsyncCall.list_entring_call")
+    archiver_termines = _bloquante("AsyncCall.archiver_termines")
+    archive = _bloquante("AsyncCall.archive")
+    purger_archive = _bloquante("AsyncCall.purger_archive")
+    compter_par_status = _bloquante("AsyncCall.compter_par_status")
+    etat_file_attente = _bloquante("AsyncCall.etat_file_attente")
+
+
+class AsyncOperator(Operator):
+    """
+    Opérateur manipulé avec asyncio, voir Operator
+    """
+
+    def __post_init__(self):
+        # L'enregistrement dans Redis est fait par AsyncOperator.create()
+        return self
+
+    # ------------------------------
+    # Propriétés en lecture seule : l'écriture passe par les méthodes set_*
+    # ------------------------------
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def call_id(self):
+        return self._call_id
+
+    @property
+    def skills(self):
+        return list(self._skills)
+
+    # ------------------------------
+    # Méthodes de l'objet
+    # ------------------------------
+
+    async def set_skills(self,value):
+        """
+        Change les groupes de l'opérateur, voir Operator.skills
+        """
+        anciens = self._skills
+        self._skills = Operator._verifier_skills(value)
+        async with get_connexion_async().pipeline(transaction=True) as pipeline:
+            pipeline.hset(Operator.cle(self._id),"skills",",".join(self._skills))
+            for groupe in self._skills:
+                pipeline.sadd(GROUPES_OPERATEURS,groupe)
+            for groupe in anciens:
+                pipeline.srem(Operator.cle_disponibles(groupe),self._id)
+            if int(self._status) == 0 :
+                for groupe in self._skills:
+                    pipeline.sadd(Operator.cle_disponibles(groupe),self._id)
+            await pipeline.execute()
+        invalider_local([Operator.cle(self._id)])
+        return self
+
+    async def set_status(self,value):
+        self._status = value
+        async with get_connexion_async().pipeline(transaction=True) as pipeline:
+            self._ecrire_status(pipeline,value)
+            await pipeline.execute()
+        invalider_local([Operator.cle(self._id)])
+        return self
+
+    async def set_call_id(self,id_call):
+        """
+        Affecte l'appel id_call à l'opérateur (script Lua atomique)
+        """
+        resultat = await AsyncCoordinator.affecter(id_call,self._id)
+        if resultat != ResultatAffectation.AFFECTE :
+            raise AffectationImpossible(resultat)
+
+        self._call_id = id_call
+        self._status = 1
+        return self
+
+    async def data(self):
+        """
+        Retourne les caractéristiques de l'opérateur
+        """
+        details_operateur = await get_connexion_async().hgetall(Operator.cle(self._id))
+        return Operator.hydrater(self._id,details_operateur)
+
+    async def destroy(self):
+        """
+        Supprime un opérateur
+        """
+        async with get_connexion_async().pipeline(transaction=True) as pipeline:
+            pipeline.srem("identifiants_operateurs",self._id)
+            pipeline.delete(Operator.cle(self._id))
+            for cle_index in INDEX_STATUS_OPERATEURS.values():
+                pipeline.srem(cle_index,self._id)
+            for groupe in self._skills:
+                pipeline.srem(Operator.cle_disponibles(groupe),self._id)
+            await pipeline.execute()
+        invalider_local([Operator.cle(self._id)])
+
+    # ------------------------------
+    # Méthodes statiques
+    # ------------------------------
+
+    @staticmethod
+    async def create(firstname,surname,skills=()):
+        """
+        Crée un opérateur et l'enregistre dans Redis (INCR puis un MULTI/EXEC)
+        """
+        identifiant = await get_connexion_async().incr("compteur_operateurs")
+        operateur = AsyncOperator(firstname,surname,id=identifiant,skills=skills)
+        async with get_connexion_async().pipeline(transaction=True) as pipeline:
+            operateur._enregistrer(pipeline)
+            await pipeline.execute()
+        return operateur
+
+    @staticmethod
+    async def _lire_lot(identifiants):
+        # Lit les hashs d'un lot d'identifiants en un seul aller-retour
+        async with get_connexion_async().pipeline(transaction=False) as pipeline:
+            for identifiant in identifiants:
+                pipeline.hgetall(Operator.cle(identifiant))
+            resultats = await pipeline.execute()
+        return [
+            Operator.hydrater(identifiant,details_operateur)
+            for identifiant, details_operateur in zip(identifiants,resultats)
+            if details_operateur
+        ]
+
+    @staticmethod
+    async def get_instance_by_id(identifiant):
+        """
+        Retourne un objet AsyncOperator pour un identifiant donné
+        """
+        details_operateur = await get_connexion_async().hgetall(Operator.cle(identifiant))
+        if details_operateur :
+            return Operator._instance(Operator.hydrater(identifiant,details_operateur),AsyncOperator)
+
+        raise Exception("L'opérateur n'existe pas. ")
+
+    @staticmethod
+    async def get_many(identifiants):
+        """
+        Retourne les objets AsyncOperator pour plusieurs identifiants en un seul aller-retour,
+        dans le même ordre, avec None pour un opérateur qui n'existe pas
+        """
+        identifiants = list(identifiants)
+        async with get_connexion_async().pipeline(transaction=False) as pipeline:
+            for identifiant in identifiants:
+                pipeline.hgetall(Operator.cle(identifiant))
+            hashs = await pipeline.execute()
+        return [
+            Operator._instance(Operator.hydrater(identifiant,details_operateur),AsyncOperator) if details_operateur else None
+            for identifiant, details_operateur in zip(identifiants,hashs)
+        ]
+
+    @staticmethod
+    async def list(taille_lot=1000):
+        """
+        Liste tous les opérateurs (SSCAN + HGETALL par lots)
+        """
+        resultat = []
+        lot = []
+        async for identifiant in get_connexion_async().sscan_iter("identifiants_operateurs",count=taille_lot):
+            lot.append(identifiant)
+            if len(lot) == taille_lot :
+                resultat += await AsyncOperator._lire_lot(lot)
+                lot = []
+        if lot :
+            resultat += await AsyncOperator._lire_lot(lot)
+        return resultat
+
+    @staticmethod
+    async def groupes():
+        """
+        Retourne les groupes (skills) connus des opérateurs
+        """
+        return sorted(await get_connexion_async().smembers(GROUPES_OPERATEURS))
+
+    @staticmethod
+    async def par_status(status,limit=None,groupe=""):
+        """
+        Liste les opérateurs d'un status donné (au plus limit), voir Operator.par_status
+        """
+        cle_index = Operator.cle_disponibles(groupe) if int(status) == 0 else INDEX_STATUS_OPERATEURS[int(status)]
+        identifiants = []
+        async for identifiant in get_connexion_async().sscan_iter(cle_index,count=limit or 1000):
+            identifiants.append(identifiant)
+            if limit is not None and len(identifiants) == limit :
+                break
+        return await AsyncOperator._lire_lot(identifiants)
+
+    @staticmethod
+    async def available(limit=None,groupe=""):
+        return await AsyncOperator.par_status(0,limit,groupe)
+
+    @staticmethod
+    async def busy(limit=None):
+        return await AsyncOperator.par_status(1,limit)
+
+    @staticmethod
+    async def destroy_all(taille_lot=1000):
+        """
+        Supprime tous les opérateurs (SSCAN puis UNLINK par lots), retourne le nombre d'opérateurs supprimés
+        """
+        nombre = 0
+        lot = []
+        async for identifiant in get_connexion_async().sscan_iter("identifiants_operateurs",count=taille_lot):
+            lot.append(Operator.cle(identifiant))
+            if len(lot) == taille_lot :
+                nombre += await get_connexion_async().unlink(*lot)
+                lot = []
+        if lot :
+            nombre += await get_connexion_async().unlink(*lot)
+
+        await get_connexion_async().unlink(
+            "identifiants_operateurs",
+            *INDEX_STATUS_OPERATEURS.values(),
+            *[Operator.cle_disponibles(groupe) for groupe in await AsyncOperator.groupes()],
+            GROUPES_OPERATEURS,
+        )
+        return nombre
+
+    # Méthodes synchrones sans version asyncio
+    batch = _bloquante("AsyncOperator.batch")
+    list_id = _bloquante("AsyncOperator.list_id")
+    iter = _bloquante("AsyncOperator.iter")
+    create_many = _bloquante("AsyncOperator.create_many")
+    migrer_compteur = _bloquante("AsyncOperator.migrer_compteur")
+
+
+class AsyncCoordinator:
+    """
+    Version asyncio de Coordinator, mêmes structures Redis
+    """
+
+    @staticmethod
+    async def affecter(appel_id,operateur_id,horodatage=None):
+        """
+        Affecte un appel à un opérateur de façon atomique, retourne un ResultatAffectation
+        """
+        while True:
+            # Mêmes lectures que Coordinator.lire_affectation, puis les clés du script (Coordinator.preparer_affectation)
+            async with get_connexion_async().pipeline(transaction=False) as pipeline:
+                pipeline.hget(Call.cle(appel_id),champ("queue"))
+                pipeline.hget(Operator.cle(operateur_id),"skills")
+                file, skills = await pipeline.execute()
+            resultat = await affecter_appel_async(
+                get_connexion_async(),*Coordinator.preparer_affectation(appel_id,operateur_id,file or "",skills or "",horodatage)
+            )
+            if resultat != ResultatAffectation.DONNEES_MODIFIEES :
+                return resultat
+
+    @staticmethod
+    async def assign_all():
+        """
+        Affecte les appels en attente, file par file, tant qu'il reste des opérateurs disponibles.
+        Retourne la liste des triplets (id appel, id opérateur, attente en secondes)
+        """
+        files = await AsyncCall.files()
+        affectations = []
+        for file in files[1:] + [""]:
+            affectations += await AsyncCoordinator.assign_file(file)
+        return affectations
+
+    @staticmethod
+    async def assign_file(file="",partitions=None):
+        """
+        Affecte les appels de la file d'attente file (de toutes ses partitions, ou de la liste
+        partitions) aux opérateurs libres de ce groupe, voir Coordinator.assign_file
+        """
+        if partitions is None :
+            partitions = range(nombre_partitions())
+        elif isinstance(partitions,int) :
+            partitions = [partitions]
+        cles_attente = [Call.cle_attente(file,partition) for partition in partitions]
+        cle_disponibles = Operator.cle_disponibles(file)
+
+        affectations = []
+        while True:
+            async with get_connexion_async().pipeline(transaction=True) as pipeline:
+                pipeline.spop(cle_disponibles)
+                if len(cles_attente) == 1 :
+                    pipeline.zpopmin(cles_attente[0])
+                else :
+                    await retirer_plus_ancien_async(get_connexion_async(),pipeline,cles_attente)
+                operateur_id, appel = await pipeline.execute()
+            if len(cles_attente) == 1 :
+                appel = [cles_attente[0],*appel[0]] if appel else None
+
+            if operateur_id is None or not appel :
+                # On remet dans leur structure les éléments retirés pour rien
+                if operateur_id is not None :
+                    await get_connexion_async().sadd(cle_disponibles,operateur_id)
+                if appel :
+                    await get_connexion_async().zadd(appel[0],{appel[1]:appel[2]})
+                break
+
+            cle_attente, appel_id, score = appel[0], appel[1], float(appel[2])
+            horodatage, _ = Call.decoder_score_attente(score)
+            resultat = await AsyncCoordinator.affecter(appel_id,operateur_id,horodatage)
+
+            if resultat in (ResultatAffectation.APPEL_INTROUVABLE,ResultatAffectation.APPEL_DEJA_PRIS) :
+                await get_connexion_async().sadd(cle_disponibles,operateur_id)
+                Coordinator.signaler_rejet(resultat,appel_id,operateur_id)
+                continue
+            if resultat in (ResultatAffectation.OPERATEUR_INTROUVABLE,ResultatAffectation.OPERATEUR_INDISPONIBLE,ResultatAffectation.OPERATEUR_NON_QUALIFIE) :
+                await get_connexion_async().zadd(cle_attente,{appel_id:score})
+                Coordinator.signaler_rejet(resultat,appel_id,operateur_id)
+                continue
+
+            affectations.append((appel_id,operateur_id,time.time() - horodatage))
+
+        return affectations
@@ -0,0 +1,216 @@
+"""
+Cache local (optionnel) des hashs des appels et des opérateurs.
+
+    activer_cache(taille_max=10000, ttl=30)
+    ...
+    statistiques_cache()   # {"hits": ..., "misses": ..., "invalidations": ..., "taille": ...}
+
+Le cache est un LRU borné à taille_max hashs, chaque entrée expirant après ttl secondes.
+L'invalidation utilise le suivi côté serveur (CLIENT TRACKING, Redis 6 et plus) en mode
+BCAST sur les préfixes des clés des appels et des opérateurs : toute écriture sur l'une
+de ces clés, par n'importe quel client, envoie un message d'invalidation sur
+__redis__:invalidate, reçu par un thread d'écoute qui retire la clé du cache.
+Si la connexion d'écoute est perdue, le cache est vidé et désactivé.
+
+Ces messages arrivent après coup : les écritures du processus lui-même (ecriture(), Session,
+scripts d'affectation et de fin d'appel, destroy) retirent aussi leurs clés du cache dès
+la réponse de Redis (invalider_local), pour qu'une lecture qui suit une écriture la voie.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from .connexion import get_connexion
+
+PREFIXES_SUIVIS = ("appels_entrants :", "ap:", "operateur :")
+
+
+class CacheEnregistrements:
+    """
+    LRU borné avec expiration, utilisable depuis plusieurs threads
+    """
+
+    def __init__(self, taille_max=10000, ttl=30.0):
+        self.taille_max = taille_max
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Incrémenté à chaque invalidation : une lecture commencée avant
+        # une invalidation n'est pas mise en cache (elle peut être périmée)
+        self.generation = 0
+        self._donnees = OrderedDict()
+        self._verrou = threading.Lock()
+
+    def lire(self, cle):
+        """
+        Retourne une copie du hash en cache, ou None
+        """
+        with self._verrou:
+            entree = self._donnees.get(cle)
+            if entree is None or entree[0] < time.monotonic():
+                if entree is not None:
+                    del self._donnees[cle]
+                self.misses += 1
+                return None
+
+            self._donnees.move_to_end(cle)
+            self.hits += 1
+            return dict(entree[1])
+
+    def ecrire(self, cle, valeur, generation):
+        """
+        Met un hash en cache, sauf si une invalidation a eu lieu depuis generation
+        """
+        with self._verrou:
+            if generation != self.generation:
+                return
+            self._donnees[cle] = (time.monotonic() + self.ttl, dict(valeur))
+            self._donnees.move_to_end(cle)
+            if len(self._donnees) > self.taille_max:
+                self._donnees.popitem(last=False)
+
+    def invalider(self, cles=None):
+        """
+        Retire des clés du cache, ou tout le cache si cles vaut None
+        """
+        with self._verrou:
+            self.generation += 1
+            self.invalidations += 1
+            if cles is None:
+                self._donnees.clear()
+            else:
+                for cle in cles:
+                    self._donnees.pop(cle, None)
+
+    def statistiques(self):
+        with self._verrou:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "taille": len(self._donnees),
+            }
+
+
+_cache = None
+_connexions_suivi = None
+
+
+def _ecouter_invalidations(cache, connexion_ecoute):
+    # Thread d'écoute des messages ["message", "__redis__:invalidate", [clés] ou None]
+    global _cache
+    try:
+        while _cache is cache:
+            try:
+                message = connexion_ecoute.read_response()
+            except redis.exceptions.TimeoutError:
+                # socket_timeout configuré : on continue d'attendre
+                continue
+            if message[0] == "message":
+                cache.invalider(message[2])
+    except Exception:
+        # Sans invalidations le cache pourrait servir des données périmées
+        if _cache is cache:
+            _cache = None
+        cache.invalider()
+
+
+def activer_cache(taille_max=10000, ttl=30.0):
+    """
+    Active le cache local des hashs des appels et des opérateurs
+    """
+    global _cache, _connexions_suivi
+    desactiver_cache()
+
+    pool = get_connexion().connection_pool
+    connexion_ecoute = pool.make_connection()
+    connexion_suivi = pool.make_connection()
+
+    # La connexion d'écoute reçoit les invalidations de la connexion de suivi
+    connexion_ecoute.send_command("CLIENT", "ID")
+    identifiant_ecoute = connexion_ecoute.read_response()
+    connexion_ecoute.send_command("SUBSCRIBE", "__redis__:invalidate")
+    connexion_ecoute.read_response()
+
+    arguments = ["CLIENT", "TRACKING", "ON", "REDIRECT", identifiant_ecoute, "BCAST"]
+    for prefixe in PREFIXES_SUIVIS:
+        arguments += ["PREFIX", prefixe]
+    connexion_suivi.send_command(*arguments)
+    connexion_suivi.read_response()
+
+    cache = CacheEnregistrements(taille_max, ttl)
+    _cache = cache
+    _connexions_suivi = (connexion_ecoute, connexion_suivi)
+    threading.Thread(target=_ecouter_invalidations, args=(cache, connexion_ecoute), daemon=True).start()
+    return cache
+
+
+def desactiver_cache():
+    """
+    Désactive le cache et ferme les connexions de suivi
+    """
+    global _cache, _connexions_suivi
+    _cache = None
+    if _connexions_suivi is not None:
+        for connexion in _connexions_suivi:
+            connexion.disconnect()
+        _connexions_suivi = None
+
+
+def invalider_local(cles=None):
+    """
+    Retire du cache les clés que ce processus vient d'écrire (tout le cache si cles vaut None),
+    sans attendre le message d'invalidation du serveur
+    """
+    cache = _cache
+    if cache is not None and (cles is None or cles):
+        cache.invalider(cles)
+
+
+def cles_suivies(pipeline):
+    """
+    Retourne les clés mises en cache (PREFIXES_SUIVIS) écrites par les commandes en attente du pipeline
+    """
+    return [
+        arguments[1] for arguments, options in pipeline.command_stack
+        if len(arguments) > 1 and isinstance(arguments[1], str) and arguments[1].startswith(PREFIXES_SUIVIS)
+    ]
+
+
+def statistiques_cache():
+    """
+    Retourne les compteurs du cache (hits, misses, invalidations, taille), ou None s'il est désactivé
+    """
+    cache = _cache
+    return cache.statistiques() if cache is not None else None
+
+
+def lire_hashs(cles):
+    """
+    HGETALL de plusieurs clés en un seul aller-retour, en passant par le cache
+    s'il est activé. Retourne les hashs dans l'ordre des clés ({} si absent)
+    """
+    cache = _cache
+    if cache is None:
+        pipeline = get_connexion().pipeline(transaction=False)
+        for cle in cles:
+            pipeline.hgetall(cle)
+        return pipeline.execute()
+
+    resultats = [cache.lire(cle) for cle in cles]
+    manquantes = [index for index, resultat in enumerate(resultats) if resultat is None]
+    if manquantes:
+        generation = cache.generation
+        pipeline = get_connexion().pipeline(transaction=False)
+        for index in manquantes:
+            pipeline.hgetall(cles[index])
+        for index, details in zip(manquantes, pipeline.execute()):
+            resultats[index] = details
+            # Les hashs absents ne sont pas mis en cache
+            if details:
+                cache.ecrire(cles[index], details, generation)
+
+    return resultats
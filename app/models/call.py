@@ -1,8 +1,34 @@
+import heapq
+import itertools
+import math
+import time
 from datetime import datetime
 from dataclasses import dataclass
-import redis 
-
-redis_connexion = redis.Redis(host="localhost",port=6379)
+from .connexion import get_connexion
+from .cache import invalider_local, lire_hashs
+from .session import Session, ecriture
+from .scripts import FinAppelImpossible, ResultatFinAppel, terminer_appel
+from .identifiants import generer_identifiant, generer_identifiants, initialiser_compteur
+from .evenements import CANAL_EVENEMENTS, NOUVEL_APPEL, signaler_coordinateur
+from .statistiques import CLE_STATISTIQUES, CLE_STATISTIQUES_OPERATEURS, cle_minute, compter_creation
+from .stockage import champ, cle_appel, compact, configure_stockage, decoder_appel, encoder_appel, nombre_partitions
+
+# Index des appels par status : sorted sets ordonnés par creation_time
+INDEX_STATUS_APPELS = {
+    0:"appels_en_attente",
+    1:"appels_pris",
+    2:"appels_termines",
+}
+
+# Files d'attente nommées (langue, équipe...) : un sorted set par file,
+# "appels_en_attente :{file}" ; les appels sans file restent dans appels_en_attente
+FILES_APPELS = "files_appels"
+
+# File d'attente : score = creation_time - priority * BANDE_PRIORITE.
+# Chaque priorité occupe sa propre bande de scores (creation_time < BANDE_PRIORITE) :
+# ZPOPMIN sert la priorité la plus haute, puis l'appel le plus ancien de cette priorité
+BANDE_PRIORITE = 10**10
+PRIORITE_MAX = 9
 
 @dataclass 
 class Call():
@@ -15,10 +41,15 @@ class Call():
         - duree : Uniquement en lecture, n'est pas écrit dans redis 
         - operator_id : Initialisé au cours de l'appel : Public
         - description : Initialisé au cours de l'appel : Public
+        - priority : 0 (par défaut) à PRIORITE_MAX, les plus hautes sont servies en premier : Public
+        - assign_time : heure de l'affectation à un opérateur (secondes depuis epoch), écrite par le script d'affectation
+        - queue : file d'attente de l'appel, "" (par défaut) pour tous les opérateurs,
+            sinon seuls les opérateurs ayant ce groupe dans leurs skills peuvent le prendre : privé
     
     Setters publics de la classe : 
         - operator_id
         - description
+        - priority
         - status
             0 pour en Attente
             1 pour Pris 
@@ -27,27 +58,45 @@ class Call():
     Méthodes publiques de la classe : 
         Propres à une instance :
             - data(self)
+            - end(self)
+            - batch(self, surveiller)
             - destroy(self)
 
         Propres à Call : 
             - list_id()
+            - hydrater(identifiant, details_appel)
             - list()
+            - iter(taille_lot)
             - destroy_all()
+            - get_instance_by_id(identifiant)
+            - get_many(identifiants)
+            - create_many(phone_numbers)
+            - migrer_compteur()
+            - migrer_stockage(compacte), memoire(echantillon)
+            - waiting(limit), taken(limit), finished(limit)
+            - compter_par_status()
+            - score_attente(horodatage, priorite), decoder_score_attente(score)
+            - cle_attente(file, partition), cles_attente(file), partition(identifiant), files()
+            - etat_file_attente(file)
+            - terminer(identifiant), lire_fin(identifiant), preparer_fin(identifiant, operateur_id, file, skills)
+            - archiver_termines(), archive(), purger_archive(avant)
 
     Limites de la classe :
         - Ne gère pas encore les erreurs si l'objet n'a pas réussi à être sauvegardé dans Redis 
-        - la méthode durée ne peut pas s'utiliser sur les données de Redis, uniquement sur les objets 
-        - Décoder en string le listing 
-        - Ne gère pas les appels attendant depuis longtemps
+        - la méthode durée ne peut pas s'utiliser sur les données de Redis, uniquement sur les objets :
+            les attentes et durées agrégées sont tenues à jour dans Redis (voir statistiques.py)
+        - Un appel de basse priorité attend tant que des appels plus prioritaires sont en attente
     """
 
-    def __init__(self,phone_number,id=0):
+    def __init__(self,phone_number,id=0,priority=0,queue=""):
         self._id = id 
         self._creation_time = datetime.now() # _ pour dire que ce sont des attributs privés
         self._phone_number = phone_number
         self._status = 0
         self._description = " "
         self._operator_id = 0
+        self._priority = Call._verifier_priorite(priority)
+        self._queue = Call._verifier_file(queue)
 
         self.__post_init__()
 
@@ -59,58 +108,16 @@ class Call():
         ## Générer l'identifiant 
         # ------------------------------
         if self._id == 0 :
-            # on récupère l'identifiant du dernier appel 
-            identifiants_appels_entrants = redis_connexion.smembers("identifiants_appels_entrants") 
-
-            if len(identifiants_appels_entrants) != 0 : 
-                # Conversion des valeurs en entiers
-                valeurs_entiers = [int(valeur) for valeur in identifiants_appels_entrants]
-
-                identifiant_max = max(valeurs_entiers)
-
-                # le nouvel appel aura l'id le plus élevé de identifiants_appels_entrants + 1
-                self._id = identifiant_max + 1
-            else :
-                self._id = 1
+            # INCR atomique sur le compteur : pas de doublon entre plusieurs processus
+            self._id = generer_identifiant(get_connexion(),"compteur_appels_entrants")
 
             # ------------------------------
             ## Enregistrer dans Redis
             # ------------------------------
-            
-            # On vérifie avant que l'objet n'est pas déjà dans Redis : 
-            identifiants_appels = redis_connexion.smembers("identifiants_appels_entrants")
-            
-            # on décode le set 
-            identifiants_appels = {element.decode() for element in identifiants_appels}
-
-            if self._id not in identifiants_appels : 
-                # On enregistre l'identifiant de l'appel 
-                redis_connexion.sadd("identifiants_appels_entrants",repr(self._id))
-
-                # Première méthode : utilisant hset 
-                redis_connexion.hset(
-                    "appels_entrants :{}".format(repr(self._id)),
-                    "creation_time",self._creation_time.strftime("%m/%d/%Y, %H:%M:%S").encode()
-                )
-                redis_connexion.hset(
-                    "appels_entrants :{}".format(repr(self._id)),
-                    "phone_number",self._phone_number.encode()
-                )
-
-                redis_connexion.hset(
-                    "appels_entrants :{}".format(repr(self._id)),
-                    "status",self.operator_id 
-                )
-
-                redis_connexion.hset(
-                    "appels_entrants :{}".format(repr(self._id)),
-                    "operator_id",self._status 
-                )
-
-                redis_connexion.hset(
-                    "appels_entrants :{}".format(repr(self._id)),
-                    "description",self.description 
-                )
+            # SADD + HSET regroupés dans un MULTI/EXEC : un seul aller-retour
+            pipeline = get_connexion().pipeline(transaction=True)
+            self._enregistrer(pipeline)
+            pipeline.execute()
 
         return self
 
@@ -126,10 +133,12 @@ class Call():
         # Pour assigner un opérateur à un Call 
         self._operator_id = value
 
-        redis_connexion.hset(
-            "appels_entrants :{}".format(repr(self._id)),
-            "operator_id",value
-        )
+        # Écriture immédiate, ou mise en attente si une session est ouverte
+        with ecriture() as pipeline:
+            pipeline.hset(
+                Call.cle(self._id),
+                champ("operator_id"),value
+            )
 
         return self
 
@@ -143,10 +152,9 @@ class Call():
 
         self._status = value
 
-        redis_connexion.hset(
-            "appels_entrants :{}".format(repr(self._id)),
-            "status",value
-        )
+        # Le hash et la file d'attente sont mis à jour dans le même MULTI/EXEC
+        with ecriture() as pipeline:
+            self._ecrire_status(pipeline,value)
         return self
 
     @property
@@ -159,12 +167,35 @@ class Call():
 
         self._description = value
 
-        redis_connexion.hset(
-            "appels_entrants :{}".format(repr(self._id)),
-            "description", value
-        )
+        with ecriture() as pipeline:
+            pipeline.hset(
+                Call.cle(self._id),
+                champ("description"), value
+            )
+        return self
+
+    @property
+    def priority(self):
+        return self._priority
+
+    @priority.setter
+    def priority(self,value):
+        # Pour changer la priorité d'un Call : un appel en attente change de place dans la file
+        self._priority = Call._verifier_priorite(value)
+
+        with ecriture() as pipeline:
+            pipeline.hset(
+                Call.cle(self._id),
+                champ("priority"), self._priority
+            )
+            # XX : l'appel n'est replacé que s'il est encore dans la file
+            pipeline.zadd(self._cle_index(0),{self._id:self._score_attente()},xx=True)
         return self
 
+    @property
+    def queue(self):
+        return self._queue
+
     @property
     def duree(self):
         # une méthode calculant la durée à chaque fois qu'il est appelé
@@ -176,52 +207,165 @@ class Call():
             duration = current_time - self._creation_time
         return duration.total_seconds()
 
+    def _horodatage(self):
+        # creation_time en secondes depuis epoch : score de l'appel dans la file d'attente
+        if not isinstance(self._creation_time, datetime):
+            return datetime.strptime(self._creation_time, "%m/%d/%Y, %H:%M:%S").timestamp()
+        return self._creation_time.timestamp()
+
+    def _score_attente(self):
+        # score de l'appel dans la file d'attente, priorité comprise
+        return Call.score_attente(self._horodatage(),self._priority)
+
+    def _score_index(self,status):
+        # Seule la file d'attente tient compte de la priorité
+        return self._score_attente() if int(status) == 0 else self._horodatage()
+
+    def _cle_index(self,status):
+        # En attente, l'appel est rangé dans la file de sa queue (dans la partition de son id)
+        if int(status) == 0 :
+            return Call.cle_attente(self._queue,Call.partition(self._id))
+        return INDEX_STATUS_APPELS[int(status)]
+
     # ------------------------------
     # Méthodes de l'objet
     # ------------------------------
 
+    def _enregistrer(self,pipeline):
+        # Ajoute au pipeline l'enregistrement de l'appel : 
+        # l'identifiant dans le set et les caractéristiques dans le hash
+        pipeline.sadd("identifiants_appels_entrants",self._id)
+        pipeline.hset(
+            Call.cle(self._id),
+            # noms des champs et format selon la disposition (classique ou compacte)
+            mapping=encoder_appel({
+                "creation_time":self._creation_time.strftime("%m/%d/%Y, %H:%M:%S"),
+                "phone_number":self._phone_number,
+                "status":self._status,
+                "operator_id":self._operator_id,
+                "description":self._description,
+                "priority":self._priority,
+                "queue":self._queue,
+            })
+        )
+        if self._queue :
+            pipeline.sadd(FILES_APPELS,self._queue)
+        # L'appel est rangé dans l'index de son status, par ordre d'arrivée (et de priorité en attente)
+        pipeline.zadd(self._cle_index(self._status),{self._id:self._score_index(self._status)})
+        if int(self._status) == 0 :
+            signaler_coordinateur(pipeline,NOUVEL_APPEL)
+        # compté dans les statistiques dans la même transaction que l'enregistrement
+        compter_creation(pipeline,self._horodatage())
+
+    def batch(self,surveiller=False):
+        """
+        Ouvre une session regroupant les écritures des setters dans un seul MULTI/EXEC,
+        avec surveiller=True le hash de l'appel est surveillé par WATCH
+        """
+        return Session(surveiller=[self] if surveiller else ())
+
+    def _ecrire_status(self,pipeline,value):
+        # Ajoute au pipeline l'écriture du status et le déplacement de l'appel
+        # vers l'index de son nouveau status
+        pipeline.hset(
+            Call.cle(self._id),
+            champ("status"),value
+        )
+        if int(value) == 0 :
+            # De retour en attente, l'appel n'a plus d'opérateur : sinon le script d'affectation le refuse
+            self._operator_id = 0
+            pipeline.hset(Call.cle(self._id),champ("operator_id"),0)
+        for status in INDEX_STATUS_APPELS:
+            if status == int(value) :
+                pipeline.zadd(self._cle_index(status),{self._id:self._score_index(status)})
+            else :
+                pipeline.zrem(self._cle_index(status),self._id)
+        if int(value) == 0 :
+            signaler_coordinateur(pipeline,NOUVEL_APPEL)
+
     def data(self):
         """
         Retourne les caractéristiques de l'appel
         """
-        
-
-        details_appel = redis_connexion.hgetall("appels_entrants :{}".format(self._id))
-        details_appel = {key.decode(): value.decode() for key, value in details_appel.items()}
-
-        details_appel['id'] = self._id # on ajoute l'identifiant au dictionnaire 
+        details_appel = Call.hydrater(self._id,lire_hashs([Call.cle(self._id)])[0])
 
         details_appel['duree'] = self.duree # on ajoute la durée au dictionnaire 
 
         return details_appel
 
+    def end(self):
+        """
+        Met fin à l'appel en une seule étape atomique (script Lua) :
+        l'opérateur est libéré, l'appel passe au status 2 puis est archivé
+        dans le stream archive_appels et retiré des structures de travail
+        """
+        resultat = Call.terminer(self._id)
+        if resultat != ResultatFinAppel.TERMINE :
+            raise FinAppelImpossible(resultat)
+
+        self._status = 2
+        return self
+
     def destroy(self):
         """
         Supprime un appel 
         """
+        pipeline = get_connexion().pipeline(transaction=True)
+
         # supprimer l'élément id du set redis 
-        redis_connexion.srem("identifiants_appels_entrants",self._id)
+        pipeline.srem("identifiants_appels_entrants",self._id)
 
         # supprimer le hachage Redis contenant les caractéristiques de l'appel 
-        redis_connexion.delete("appels_entrants :{}".format(self._id))
+        pipeline.delete(Call.cle(self._id))
+
+        # retirer l'appel des index par status 
+        for status in INDEX_STATUS_APPELS:
+            pipeline.zrem(self._cle_index(status),self._id)
+        pipeline.execute()
+        invalider_local([Call.cle(self._id)])
         del self 
 
     # ------------------------------
     # Méthodes statiques
     # ------------------------------
 
+    @staticmethod
+    def cle(identifiant):
+        """
+        Retourne la clé du hash Redis contenant les caractéristiques d'un appel
+        (selon la disposition classique ou compacte, voir stockage.py)
+        """
+        return cle_appel(identifiant)
+
+    @staticmethod
+    def hydrater(identifiant,details_appel):
+        """
+        Convertit le hash Redis d'un appel (déjà décodé par la connexion)
+        en dictionnaire typé : seul endroit où les champs sont convertis
+        """
+        details_appel = decoder_appel(details_appel)
+        details_appel["id"] = identifiant # on ajoute l'identifiant au dictionnaire
+        details_appel["status"] = int(details_appel.get("status",0))
+        details_appel["operator_id"] = int(details_appel.get("operator_id",0))
+        details_appel["priority"] = int(details_appel.get("priority",0))
+        details_appel.setdefault("queue","")
+        if "assign_time" in details_appel :
+            details_appel["assign_time"] = float(details_appel["assign_time"])
+        return details_appel
+
     @staticmethod
     def data_by_id(id_call):
         """
         Retourne les données d'un appel par id 
         """
         # On récupère la liste des appels entrants pour un identifiant donné 
-        details_appel = redis_connexion.hgetall("appels_entrants :{}".format(id_call))
-        
-        # Convertir les clés et les valeurs en chaînes de caractères
-        details_appel = {key.decode(): value.decode() for key, value in details_appel.items()}
+        details_appel = lire_hashs([Call.cle(id_call)])[0]
 
-        return details_appel
+        # Un hash vide : l'appel n'existe pas
+        if not details_appel :
+            return details_appel
+
+        return Call.hydrater(id_call,details_appel)
 
     @staticmethod
     def list_id():
@@ -229,78 +373,489 @@ class Call():
         Liste tous les identifiants des appels enregistrés dans Redis,
         enregistrés dans le set identifiants_appels_entrants
         """
-        return [identifiant.decode() for identifiant in redis_connexion.smembers("identifiants_appels_entrants")]
+        return list(get_connexion().smembers("identifiants_appels_entrants"))
 
 
     @staticmethod
-    def list():
+    def list(taille_lot=1000):
         """
         Liste tous les appels ainsi que leurs descriptions,
-        enregistrés dans le hash Redis appels_entrants + id
+        enregistrés dans le hash Redis appels_entrants + id.
+        Construit la liste complète en mémoire : pour de gros volumes, utiliser Call.iter()
         """
-        appels = []
-        identifiants_appels_entrants = redis_connexion.smembers("identifiants_appels_entrants")
-        for identifiant in identifiants_appels_entrants:
-            details_appel = redis_connexion.hgetall("appels_entrants :{}".format(identifiant))
-
-            # Convertir les clés et les valeurs en chaînes de caractères
-            details_appel = {key.decode(): value.decode() for key, value in details_appel.items()}
+        return list(Call.iter(taille_lot))
 
-            details_appel["id"] = identifiant.decode()  # on ajoute l'identifiant au dictionnaire
-            appels.append(details_appel)
+    @staticmethod
+    def iter(taille_lot=1000):
+        """
+        Générateur parcourant les appels un par un, sans charger tout le set :
+        les identifiants sont lus par SSCAN et les hashs par lots de taille_lot
+        dans un pipeline, la mémoire utilisée reste bornée par taille_lot.
+        Comme tout SCAN, un élément peut être retourné deux fois si le set
+        est modifié pendant le parcours
+        """
+        lot = []
+        for identifiant in get_connexion().sscan_iter("identifiants_appels_entrants",count=taille_lot):
+            lot.append(identifiant)
+            if len(lot) == taille_lot :
+                yield from Call._lire_lot(lot)
+                lot = []
 
-        return appels
+        if lot :
+            yield from Call._lire_lot(lot)
 
+    @staticmethod
+    def _lire_lot(identifiants):
+        # Lit les hashs d'un lot d'identifiants en un seul aller-retour (ou depuis le cache)
+        hashs = lire_hashs([Call.cle(identifiant) for identifiant in identifiants])
+        # L'appel a pu être supprimé entre SSCAN et HGETALL : hash vide ignoré
+        return [
+            Call.hydrater(identifiant,details_appel)
+            for identifiant, details_appel in zip(identifiants,hashs)
+            if details_appel
+        ]
 
     @staticmethod
-    def destroy_all():
+    def destroy_all(taille_lot=1000):
         """
         Supprime tous les appels : 
         - Dans le set identifiants_appels_entrants contenant les id 
         - Dans le hash appels_entrants contenant les détails des appels 
+        Les identifiants sont lus par SSCAN et les hashs supprimés par UNLINK
+        (libération de la mémoire en arrière-plan côté serveur), taille_lot clés par commande.
+        Retourne le nombre d'appels supprimés
         """
-        # On récupère tous les identifiants enregistrés 
-        all_keys = Call.list_id()
-
-        # Parcourir les clés et supprimer les hachages redis 
-        for key in all_keys:
-            # on supprime l'identifiant du set contenant les identifiants 
-            redis_connexion.srem("identifiants_appels_entrants",key)
-
-            # on supprime les éléments du hash contenant les détails de l'appel 
-            redis_connexion.delete("appels_entrants :{}".format(key))
+        nombre = 0
+        lot = []
+        for identifiant in get_connexion().sscan_iter("identifiants_appels_entrants",count=taille_lot):
+            lot.append(Call.cle(identifiant))
+            if len(lot) == taille_lot :
+                # UNLINK retourne le nombre de clés supprimées : un doublon de SSCAN n'est pas compté
+                nombre += get_connexion().unlink(*lot)
+                lot = []
+        if lot :
+            nombre += get_connexion().unlink(*lot)
+
+        # le set des identifiants et les index par status sont supprimés d'un coup
+        get_connexion().unlink(
+            "identifiants_appels_entrants",
+            *INDEX_STATUS_APPELS.values(),*[cle for file in Call.files() for cle in Call.cles_attente(file)],FILES_APPELS,
+        )
+        invalider_local()
+        return nombre
 
     @staticmethod
     def get_instance_by_id(identifiant):
         """
         Retourne un objet Call pour un identifiant donné
         """
-        identifiants_appels_entrants = Call.list_id()
+        # Un seul HGETALL : un hash vide veut dire que l'appel n'existe pas
+        details_appel = Call.data_by_id(identifiant)
 
-        if identifiant in identifiants_appels_entrants:
-            details_appel = redis_connexion.hgetall("appels_entrants :{}".format(identifiant))
-            phone_number = details_appel.get(b"phone_number", b"").decode()
+        if details_appel :
+            return Call._instance(details_appel)
+
+        raise Exception("L'appel n'existe pas.")
 
-            # Créer une nouvelle instance d'appel avec les informations récupérées
-            instance = Call(phone_number,id=identifiant)
+    @staticmethod
+    def get_many(identifiants):
+        """
+        Retourne les objets Call pour plusieurs identifiants en un seul aller-retour,
+        dans le même ordre, avec None pour un appel qui n'existe pas
+        """
+        identifiants = list(identifiants)
+        hashs = lire_hashs([Call.cle(identifiant) for identifiant in identifiants])
+        return [
+            Call._instance(Call.hydrater(identifiant,details_appel)) if details_appel else None
+            for identifiant, details_appel in zip(identifiants,hashs)
+        ]
 
-            # Récupérer et assigner les autres attributs de l'appel (status, operator_id, description)
-            instance._status = int(details_appel.get(b"status", 0))
-            instance._phone_number = int(details_appel.get(b"phone_number", 0))
-            instance._description = details_appel.get(b"description", b"").decode()
-            instance._creation_time = details_appel.get(b"creation_time", b"").decode()
-            
-            return instance
+    @staticmethod
+    def _instance(details_appel,classe=None):
+        # Crée l'objet Call (ou classe, AsyncCall) à partir d'un hash hydraté, sans passer par __init__ :
+        # __post_init__ (génération de l'identifiant, enregistrement) n'est pas relancé
+        instance = object.__new__(classe or Call)
+        instance._id = details_appel["id"]
+        instance._phone_number = details_appel.get("phone_number","")
+        instance._creation_time = details_appel.get("creation_time","")
+        instance._status = details_appel["status"]
+        instance._operator_id = details_appel["operator_id"]
+        instance._description = details_appel.get("description","")
+        instance._priority = details_appel.get("priority",0)
+        instance._queue = details_appel.get("queue","")
+        return instance
 
-        raise Exception("L'appel n'existe pas.")
+    @staticmethod
+    def create_many(phone_numbers,taille_lot=1000,priority=0,queue=""):
+        """
+        Crée un appel par numéro de téléphone, de priorité priority dans la file queue, et les enregistre
+        dans Redis par lots de taille_lot appels (un MULTI/EXEC par lot).
+        Retourne la liste des objets Call créés
+        """
+        phone_numbers = list(phone_numbers)
+        if not phone_numbers :
+            return []
+
+        # Un seul INCRBY pour réserver tous les identifiants
+        identifiants = generer_identifiants(get_connexion(),"compteur_appels_entrants",len(phone_numbers))
+
+        # Un identifiant non nul évite l'enregistrement dans __post_init__
+        appels = [Call(phone_number,id=identifiant,priority=priority,queue=queue) for phone_number, identifiant in zip(phone_numbers,identifiants)]
+
+        for debut in range(0,len(appels),taille_lot):
+            pipeline = get_connexion().pipeline(transaction=True)
+            for appel in appels[debut:debut+taille_lot]:
+                appel._enregistrer(pipeline)
+            pipeline.execute()
+
+        return appels
+
+    @staticmethod
+    def migrer_compteur():
+        """
+        Initialise le compteur d'identifiants à partir des appels déjà enregistrés
+        (à lancer une fois sur une base créée avant l'utilisation du compteur)
+        """
+        return initialiser_compteur(get_connexion(),"identifiants_appels_entrants","compteur_appels_entrants")
+
+    @staticmethod
+    def migrer_stockage(compacte=True,taille_lot=1000):
+        """
+        Réécrit les hashs des appels dans la disposition compacte (ou classique),
+        par lots de taille_lot (un MULTI/EXEC par lot : HSET du nouveau hash, UNLINK de l'ancien),
+        puis utilise cette disposition dans ce processus.
+        À lancer sans autre client actif : une écriture pendant la migration peut être perdue.
+        Retourne le nombre d'appels migrés
+        """
+        nombre = 0
+        lot = []
+        for identifiant in get_connexion().sscan_iter("identifiants_appels_entrants",count=taille_lot):
+            lot.append(identifiant)
+            if len(lot) == taille_lot :
+                nombre += Call._migrer_lot(lot,compacte)
+                lot = []
+        if lot :
+            nombre += Call._migrer_lot(lot,compacte)
+
+        configure_stockage(compacte)
+        invalider_local()
+        return nombre
+
+    @staticmethod
+    def _migrer_lot(identifiants,compacte):
+        # Les hashs déjà dans la disposition cible sont absents de l'ancienne : ignorés
+        pipeline = get_connexion().pipeline(transaction=False)
+        for identifiant in identifiants:
+            pipeline.hgetall(cle_appel(identifiant,not compacte))
+        hashs = pipeline.execute()
+
+        pipeline = get_connexion().pipeline(transaction=True)
+        nombre = 0
+        for identifiant, details_appel in zip(identifiants,hashs):
+            if details_appel :
+                pipeline.hset(cle_appel(identifiant,compacte),mapping=encoder_appel(decoder_appel(details_appel),compacte))
+                pipeline.unlink(cle_appel(identifiant,not compacte))
+                nombre += 1
+        pipeline.execute()
+        return nombre
+
+    @staticmethod
+    def memoire(echantillon=1000):
+        """
+        Estime la mémoire occupée par les hashs des appels : MEMORY USAGE et
+        OBJECT ENCODING sur un échantillon d'appels tirés au hasard (SRANDMEMBER)
+        """
+        nombre = get_connexion().scard("identifiants_appels_entrants")
+        identifiants = get_connexion().srandmember("identifiants_appels_entrants",echantillon)
+
+        pipeline = get_connexion().pipeline(transaction=False)
+        for identifiant in identifiants:
+            pipeline.memory_usage(Call.cle(identifiant))
+            pipeline.object("encoding",Call.cle(identifiant))
+        resultats = pipeline.execute()
+
+        tailles = [taille for taille in resultats[0::2] if taille]
+        encodages = {}
+        for encodage in resultats[1::2]:
+            if encodage :
+                encodages[encodage] = encodages.get(encodage,0) + 1
+
+        octets_par_appel = sum(tailles) / len(tailles) if tailles else 0
+        return {
+            "disposition":"compacte" if compact() else "classique",
+            "appels":nombre,
+            "octets_par_appel":octets_par_appel,
+            "octets_estimes":int(octets_par_appel * nombre),
+            "encodages":encodages,
+        }
 
     @staticmethod
     def list_entring_call():
         """
         Liste les appels entrants
         """
-        pass
+        return Call.waiting()
+
+    @staticmethod
+    def par_status(status,limit=None):
+        """
+        Liste les appels d'un status donné, du plus ancien au plus récent,
+        en ne lisant que les hashs de ces appels (au plus limit appels)
+        """
+        if int(status) == 0 :
+            return Call.waiting(limit)
+
+        fin = -1 if limit is None else limit - 1
+        identifiants = get_connexion().zrange(INDEX_STATUS_APPELS[int(status)],0,fin)
+        return Call._lire_lot(identifiants)
+
+    @staticmethod
+    def waiting(limit=None,queue=None):
+        """
+        Liste les appels en attente (status 0) de la file queue, ou de toutes les files,
+        dans l'ordre où ils seront servis : par priorité décroissante, puis du plus ancien au plus récent
+        """
+        fin = -1 if limit is None else limit - 1
+        files = Call.files() if queue is None else [queue]
+        pipeline = get_connexion().pipeline(transaction=False)
+        for file in files:
+            for cle in Call.cles_attente(file):
+                pipeline.zrange(cle,0,fin,withscores=True)
+
+        # Chaque file (et chaque partition) est déjà triée : fusion par score
+        appels = heapq.merge(*pipeline.execute(),key=lambda appel: appel[1])
+        identifiants = [identifiant for identifiant, score in itertools.islice(appels,limit)]
+        return Call._lire_lot(identifiants)
+
+    @staticmethod
+    def taken(limit=None):
+        """
+        Liste les appels pris (status 1)
+        """
+        return Call.par_status(1,limit)
+
+    @staticmethod
+    def finished(limit=None):
+        """
+        Liste les appels terminés (status 2)
+        """
+        return Call.par_status(2,limit)
+
+    @staticmethod
+    def archiver_termines(taille_lot=1000):
+        """
+        Archive les appels passés au status 2 par le setter (sans Call.end()),
+        par lots de taille_lot. Retourne le nombre d'appels archivés
+        """
+        nombre = 0
+        while True:
+            identifiants = get_connexion().zrange("appels_termines",0,taille_lot - 1)
+            if not identifiants :
+                return nombre
+
+            introuvables = []
+            for identifiant in identifiants:
+                resultat = Call.terminer(identifiant)
+                if resultat == ResultatFinAppel.TERMINE :
+                    nombre += 1
+                else :
+                    introuvables.append(identifiant)
+            # Un identifiant sans hash (supprimé, ou dans l'autre disposition) quitte l'index :
+            # sinon le lot suivant le relirait indéfiniment
+            if introuvables :
+                get_connexion().zrem("appels_termines",*introuvables)
+
+    @staticmethod
+    def terminer(identifiant):
+        """
+        Termine et archive l'appel identifiant (script Lua, voir end()), retourne un ResultatFinAppel
+        """
+        while True:
+            # L'opérateur et la file de l'appel donnent les clés du script ; s'ils changent avant le script, on les relit
+            operateur_id, file, skills = Call.lire_fin(identifiant)
+            resultat = terminer_appel(get_connexion(),*Call.preparer_fin(identifiant,operateur_id,file,skills))
+            if resultat != ResultatFinAppel.DONNEES_MODIFIEES :
+                return resultat
+
+    @staticmethod
+    def lire_fin(identifiant):
+        """
+        Retourne l'opérateur ("0" sans opérateur) et la file de l'appel, et les skills
+        (tels qu'enregistrés) de l'opérateur
+        """
+        from .operator import Operator
+
+        operateur_id, file = get_connexion().hmget(Call.cle(identifiant),champ("operator_id"),champ("queue"))
+        operateur_id = operateur_id or "0"
+        skills = get_connexion().hget(Operator.cle(operateur_id),"skills") if operateur_id != "0" else None
+        return operateur_id, file or "", skills or ""
+
+    @staticmethod
+    def preparer_fin(identifiant,operateur_id,file,skills):
+        """
+        Retourne les KEYS et ARGV du script de fin d'appel (scripts.SCRIPT_FIN_APPEL) :
+        toutes les clés écrites par le script y figurent
+        """
+        # import local : operator.py importe déjà call.py
+        from .operator import Operator
+
+        cles = [
+            Call.cle(identifiant),"identifiants_appels_entrants",Call.cle_attente(file,Call.partition(identifiant)),
+            INDEX_STATUS_APPELS[1],INDEX_STATUS_APPELS[2],"archive_appels",
+            Operator.cle_disponibles(),"operateurs_occupes",CANAL_EVENEMENTS,
+            CLE_STATISTIQUES,cle_minute(time.time()),CLE_STATISTIQUES_OPERATEURS,
+        ]
+        if operateur_id != "0" :
+            cles.append(Operator.cle(operateur_id))
+            cles += [Operator.cle_disponibles(groupe) for groupe in Operator._verifier_skills(skills)]
+        return cles, [identifiant,operateur_id,file,skills]
+
+    @staticmethod
+    def archive(count=100,debut="-",fin="+"):
+        """
+        Retourne les appels archivés entre les identifiants de stream debut et fin
+        (au plus count), chacun avec son heure de fin en secondes depuis epoch
+        """
+        return [
+            Call.hydrater(champs["id"],champs)
+            for identifiant_stream, champs in get_connexion().xrange("archive_appels",debut,fin,count=count)
+        ]
 
+    @staticmethod
+    def purger_archive(avant):
+        """
+        Supprime de l'archive les appels terminés avant le timestamp avant (secondes)
+        """
+        return get_connexion().xtrim("archive_appels",minid="{}-0".format(int(avant * 1000)))
+
+    @staticmethod
+    def compter_par_status():
+        """
+        Retourne le nombre d'appels pour chaque status (ZCARD, sans parcourir les appels)
+        """
+        cles_attente = [cle for file in Call.files() for cle in Call.cles_attente(file)]
+        pipeline = get_connexion().pipeline(transaction=False)
+        for cle in cles_attente:
+            pipeline.zcard(cle)
+        for cle_index in list(INDEX_STATUS_APPELS.values())[1:]:
+            pipeline.zcard(cle_index)
+        resultats = pipeline.execute()
+        # Les appels en attente sont répartis entre les files et leurs partitions
+        return dict(zip(
+            INDEX_STATUS_APPELS.keys(),[sum(resultats[:len(cles_attente)])] + resultats[len(cles_attente):]
+        ))
+
+
+    @staticmethod
+    def _verifier_priorite(priorite):
+        # La priorité doit rester dans les bandes de score de la file d'attente
+        priorite = int(priorite)
+        if not 0 <= priorite <= PRIORITE_MAX :
+            raise Exception("La priorité doit être comprise entre 0 et {}.".format(PRIORITE_MAX))
+        return priorite
+
+    @staticmethod
+    def score_attente(horodatage,priorite=0):
+        """
+        Retourne le score d'un appel dans la file d'attente
+        à partir de son creation_time (secondes depuis epoch) et de sa priorité
+        """
+        return horodatage - priorite * BANDE_PRIORITE
+
+    @staticmethod
+    def decoder_score_attente(score):
+        """
+        Retourne le couple (creation_time, priorité) correspondant à un score de la file d'attente
+        """
+        priorite = -math.floor(score / BANDE_PRIORITE)
+        return score + priorite * BANDE_PRIORITE, priorite
+
+    @staticmethod
+    def etat_file_attente(queue=None):
+        """
+        Retourne la profondeur de la file d'attente queue et l'attente (secondes) de l'appel
+        le plus ancien, au total et par priorité ; sans queue, l'état de toutes les files
+        (total et par_file). Un seul aller-retour : un ZRANGEBYSCORE limité à un élément
+        et un ZCOUNT par bande de priorité (et par partition), sans parcourir les files
+        """
+        files = Call.files() if queue is None else [queue]
+        pipeline = get_connexion().pipeline(transaction=False)
+        for file in files:
+            for priorite in range(PRIORITE_MAX + 1):
+                # bande de scores de la priorité : [score(0), score(BANDE_PRIORITE)[
+                minimum = Call.score_attente(0,priorite)
+                maximum = "({}".format(Call.score_attente(BANDE_PRIORITE,priorite))
+                for cle in Call.cles_attente(file):
+                    pipeline.zrangebyscore(cle,minimum,maximum,start=0,num=1,withscores=True)
+                    pipeline.zcount(cle,minimum,maximum)
+        resultats = iter(pipeline.execute())
+
+        maintenant = time.time()
+        par_file = {}
+        for file in files:
+            par_priorite = {}
+            for priorite in range(PRIORITE_MAX + 1):
+                nombre = 0
+                plus_anciens = []
+                for cle in Call.cles_attente(file):
+                    plus_anciens += next(resultats)
+                    nombre += next(resultats)
+                if nombre :
+                    horodatage, _ = Call.decoder_score_attente(min(score for _, score in plus_anciens))
+                    par_priorite[priorite] = {"profondeur":nombre,"attente_max":maintenant - horodatage}
+            par_file[file] = {
+                "profondeur":sum(etat["profondeur"] for etat in par_priorite.values()),
+                "attente_max":max((etat["attente_max"] for etat in par_priorite.values()),default=0.0),
+                "par_priorite":par_priorite,
+            }
+
+        if queue is not None :
+            return par_file[queue]
+        return {
+            "profondeur":sum(etat["profondeur"] for etat in par_file.values()),
+            "attente_max":max((etat["attente_max"] for etat in par_file.values()),default=0.0),
+            "par_file":par_file,
+        }
+
+    @staticmethod
+    def cle_attente(queue="",partition=0):
+        """
+        Retourne la clé du sorted set de la partition partition de la file d'attente queue
+        (la même clé pour toute la file s'il n'y a qu'une partition, voir stockage.py)
+        """
+        cle = "{} :{}".format(INDEX_STATUS_APPELS[0],queue) if queue else INDEX_STATUS_APPELS[0]
+        if nombre_partitions() > 1 :
+            cle = "{} #{}".format(cle,partition)
+        return cle
+
+    @staticmethod
+    def cles_attente(queue=""):
+        """
+        Retourne les clés de toutes les partitions de la file d'attente queue
+        """
+        return [Call.cle_attente(queue,partition) for partition in range(nombre_partitions())]
+
+    @staticmethod
+    def partition(identifiant):
+        """
+        Retourne la partition de la file d'attente où est rangé l'appel identifiant
+        """
+        return int(identifiant) % nombre_partitions()
+
+    @staticmethod
+    def files():
+        """
+        Retourne les files d'attente connues, la file par défaut "" en premier
+        """
+        return [""] + sorted(get_connexion().smembers(FILES_APPELS))
+
+    @staticmethod
+    def _verifier_file(queue):
+        # Le nom de la file sert dans les clés et dans la liste des skills des opérateurs
+        queue = str(queue or "")
+        if "," in queue :
+            raise Exception("Le nom d'une file ne peut pas contenir de virgule.")
+        return queue
 
 
 if __name__ == '__main__' : 
@@ -0,0 +1,170 @@
+"""
+Connexion Redis partagée par tous les modèles.
+
+La connexion n'est créée qu'à la première utilisation (get_connexion()),
+à partir des variables d'environnement ou des paramètres passés à configure() :
+
+    REDIS_HOST                  (localhost)
+    REDIS_PORT                  (6379)
+    REDIS_DB                    (0)
+    REDIS_PASSWORD
+    REDIS_MAX_CONNECTIONS       (50)
+    REDIS_SOCKET_TIMEOUT        (secondes)
+    REDIS_SOCKET_CONNECT_TIMEOUT (secondes)
+    REDIS_RETRY_ON_TIMEOUT      (0 ou 1)
+    REDIS_DECODE_RESPONSES      (1 par défaut, les modèles attendent des réponses décodées)
+    REDIS_BACKEND               (redis, ou memoire)
+
+Le pool de connexions est partagé entre les threads : chaque commande
+emprunte une connexion au pool puis la rend.
+
+Avec REDIS_BACKEND=memoire (ou configure(backend="memoire")), les modèles utilisent un
+serveur Redis simulé dans le processus (fakeredis, pip install "fakeredis[lua]"), sans réseau :
+mêmes clés, mêmes commandes, mêmes scripts Lua et mêmes transactions qu'avec redis-server.
+Les connexions synchrones et asyncio du processus partagent ce serveur, vide au démarrage ;
+configure() n'en crée un nouveau que si reinitialiser_memoire() est appelé.
+Pour les tests et la simulation de charge (python -m app.simulation), pas pour la production.
+"""
+import os
+import threading
+
+import redis
+
+_verrou = threading.Lock()
+_parametres = {}
+_connexion = None
+_connexion_async = None
+_serveur_memoire = None
+
+BACKENDS = ("redis", "memoire")
+
+
+def _parametres_environnement():
+    # Paramètres par défaut, surchargés par les variables d'environnement
+    def flottant(nom):
+        valeur = os.environ.get(nom)
+        return float(valeur) if valeur else None
+
+    return {
+        "host": os.environ.get("REDIS_HOST", "localhost"),
+        "port": int(os.environ.get("REDIS_PORT", 6379)),
+        "db": int(os.environ.get("REDIS_DB", 0)),
+        "password": os.environ.get("REDIS_PASSWORD") or None,
+        "max_connections": int(os.environ.get("REDIS_MAX_CONNECTIONS", 50)),
+        "socket_timeout": flottant("REDIS_SOCKET_TIMEOUT"),
+        "socket_connect_timeout": flottant("REDIS_SOCKET_CONNECT_TIMEOUT"),
+        "retry_on_timeout": os.environ.get("REDIS_RETRY_ON_TIMEOUT", "0") == "1",
+        "decode_responses": os.environ.get("REDIS_DECODE_RESPONSES", "1") == "1",
+    }
+
+
+def configure(**parametres):
+    """
+    Configure la connexion partagée, avant ou après sa création :
+    host, port, db, password, max_connections, socket_timeout,
+    socket_connect_timeout, retry_on_timeout, decode_responses, backend ("redis" ou "memoire"),
+    client_class (sous-classe de redis.Redis pour le client synchrone partagé, voir instrumentation.py),
+    ainsi que tout autre paramètre accepté par redis.ConnectionPool
+    (par exemple connection_class).
+    Les paramètres non précisés gardent la valeur de l'environnement.
+    """
+    global _connexion, _connexion_async
+    with _verrou:
+        _parametres.clear()
+        _parametres.update(parametres)
+
+        # La prochaine utilisation recrée la connexion avec les nouveaux paramètres
+        if _connexion is not None:
+            _connexion.connection_pool.disconnect()
+        _connexion = None
+        _connexion_async = None
+
+
+def backend():
+    """
+    Retourne le backend effectif : "redis" ou "memoire"
+    """
+    nom = _parametres.get("backend") or os.environ.get("REDIS_BACKEND", "redis")
+    if nom not in BACKENDS:
+        raise Exception("Backend inconnu : {} (attendu : {}).".format(nom, ", ".join(BACKENDS)))
+    return nom
+
+
+def _modifier_parametres(**modifications):
+    # Comme configure(), en gardant les autres paramètres déjà configurés
+    parametres = dict(_parametres)
+    parametres.update(modifications)
+    configure(**parametres)
+
+
+def reinitialiser_memoire():
+    """
+    Remplace le serveur en mémoire par un serveur vide (backend "memoire")
+    """
+    global _serveur_memoire
+    configure(**dict(_parametres))
+    _serveur_memoire = None
+
+
+def parametres(asynchrone=False):
+    """
+    Retourne les paramètres effectifs du pool de connexions (redis.ConnectionPool, ou
+    redis.asyncio.ConnectionPool si asynchrone), utilisables tels quels pour ouvrir une autre
+    connexion : avec le backend "memoire", ils désignent le serveur en mémoire partagé
+    """
+    global _serveur_memoire
+    options = _parametres_environnement()
+    options.update(_parametres)
+    options.pop("backend", None)
+    options.pop("client_class", None)
+    if backend() == "memoire":
+        try:
+            import fakeredis
+            import fakeredis.aioredis
+        except ImportError:
+            raise Exception('Le backend "memoire" nécessite fakeredis : pip install "fakeredis[lua]"')
+        if _serveur_memoire is None:
+            _serveur_memoire = fakeredis.FakeServer()
+        options["server"] = _serveur_memoire
+        # FakeConnection (fakeredis < 2.30) a été renommée FakeRedisConnection
+        options["connection_class"] = (
+            getattr(fakeredis.aioredis, "FakeAsyncRedisConnection", None) or fakeredis.aioredis.FakeConnection
+            if asynchrone else
+            getattr(fakeredis, "FakeRedisConnection", None) or fakeredis.FakeConnection
+        )
+    return options
+
+
+def get_connexion():
+    """
+    Retourne le client redis.Redis partagé, créé à la première utilisation
+    """
+    global _connexion
+    if _connexion is None:
+        with _verrou:
+            # Un autre thread a pu créer la connexion pendant l'attente du verrou
+            if _connexion is None:
+                classe = _parametres.get("client_class") or redis.Redis
+                _connexion = classe(connection_pool=redis.ConnectionPool(**parametres()))
+    return _connexion
+
+
+def get_connexion_async():
+    """
+    Retourne le client redis.asyncio.Redis partagé, avec les mêmes paramètres.
+    Le pool asyncio est lié à la boucle d'événements qui l'utilise en premier
+    """
+    global _connexion_async
+    if _connexion_async is None:
+        with _verrou:
+            if _connexion_async is None:
+                import redis.asyncio
+
+                options = parametres(asynchrone=True)
+                if backend() != "memoire":
+                    # La classe de connexion synchrone ne convient pas au pool asyncio
+                    options.pop("connection_class", None)
+                _connexion_async = redis.asyncio.Redis(
+                    connection_pool=redis.asyncio.ConnectionPool(**options)
+                )
+    return _connexion_async
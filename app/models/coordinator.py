@@ -1,30 +1,238 @@
-from webbrowser import Opera
+import logging
+import time
+from datetime import datetime
 from .operator import *
 from .call import *
+from .connexion import get_connexion
+from .scripts import MESSAGES_AFFECTATION, ResultatAffectation, affecter_appel, resultat_affectation, retirer_plus_ancien
+from .statistiques import CLE_STATISTIQUES, cle_minute
+from .stockage import champ, nombre_partitions
+
+logger = logging.getLogger(__name__)
+
+# Nombre maximal d'affectations préparées et envoyées ensemble par assign_file
+TAILLE_LOT_AFFECTATION = 100
 
 
 class Coordinator:
+    """
+    Affecte les appels en attente aux opérateurs disponibles.
+
+    Structures Redis utilisées :
+        - appels_en_attente : sorted set des appels au status 0,
+          score = creation_time - priorité * BANDE_PRIORITE (Call.score_attente)
+        - operateurs_disponibles : set des opérateurs au status 0
+        - appels_en_attente :{file} / operateurs_disponibles :{groupe} : les mêmes structures
+          pour chaque file nommée et chaque groupe d'opérateurs (Call.queue, Operator.skills).
+          Un appel d'une file ne va qu'à un opérateur du groupe du même nom : SPOP sur le set
+          du groupe, sans filtrer la liste des opérateurs
+        - appels_en_attente #{partition} : avec plusieurs partitions (stockage.py), chaque file
+          est découpée en sorted sets ; plusieurs coordinateurs se les répartissent (repartition.py)
+    ainsi que les autres index par status (INDEX_STATUS_APPELS, INDEX_STATUS_OPERATEURS)
+
+    Chaque affectation retire l'appel et l'opérateur de ces structures
+    (ZPOPMIN / SPOP, atomiques) : un opérateur ne peut pas être affecté deux fois,
+    même avec plusieurs coordinateurs.
+    """
+
     @staticmethod
     def assign_all():
-        appels = Call.list()
-        operateurs = Operator.list()
-        for appel in appels:
-            if appel['status'] == '0':
-                for operateur in operateurs:
-                    if operateur['status'] == "0":
-                        # On récupère les objets
-                        appel_instance = Call.get_instance_by_id(appel['id'])
-                        operateur_instance = Operator.get_instance_by_id(operateur['id'])
-                        
-                        # On change les attributs
-                        appel_instance.status = 1
-                        operateur_instance.call_id = appel['id']
-                        operateur_instance.status = 1
-                        print(f"Appel {appel['id']} assigné à l'opérateur {operateur['id']}")
-                        break
-                else:
-                    print(f"Aucun opérateur disponible pour l'appel {appel['id']}")
-            else:
-                print(f"L'appel {appel['id']} est déjà en cours")
-
-        return
+        """
+        Affecte les appels en attente, file par file, par priorité décroissante puis
+        du plus ancien au plus récent, tant qu'il reste des opérateurs disponibles.
+        Les files nommées passent avant la file par défaut, qui peut prendre n'importe quel opérateur.
+        Retourne la liste des triplets (id appel, id opérateur, attente en secondes)
+        affectés, l'attente étant mesurée depuis la création de l'appel
+        """
+        affectations = []
+        for file in Call.files()[1:] + [""]:
+            affectations += Coordinator.assign_file(file)
+        return affectations
+
+    @staticmethod
+    def assign_partitions(partitions):
+        """
+        Affecte les appels des partitions données, couples (file, numéro de partition),
+        les files nommées avant la file par défaut ; dans chaque file, l'ordre de service
+        (priorité puis ancienneté) vaut pour l'ensemble de ces partitions.
+        Voir assign_all pour le résultat
+        """
+        par_file = {}
+        for file, partition in partitions:
+            par_file.setdefault(file,[]).append(partition)
+
+        affectations = []
+        for file in sorted(par_file,key=lambda file: (file == "",file)):
+            affectations += Coordinator.assign_file(file,sorted(par_file[file]))
+        return affectations
+
+    @staticmethod
+    def assign_file(file="",partitions=None,taille_lot=TAILLE_LOT_AFFECTATION):
+        """
+        Affecte les appels de la file d'attente file (de toutes ses partitions, ou de la liste
+        partitions) aux opérateurs libres de ce groupe (n'importe quel opérateur libre pour
+        la file par défaut ""), en servant toujours l'appel de plus petit score parmi ces partitions.
+        Les affectations sont traitées par lots de taille_lot : trois allers-retours par lot
+        (retrait, lecture des skills, scripts d'affectation).
+        Voir assign_all pour le résultat
+        """
+        if partitions is None :
+            partitions = range(nombre_partitions())
+        elif isinstance(partitions,int) :
+            partitions = [partitions]
+        cles_attente = [Call.cle_attente(file,partition) for partition in partitions]
+        cle_disponibles = Operator.cle_disponibles(file)
+
+        affectations = []
+        while True:
+            # Jusqu'à taille_lot opérateurs disponibles du groupe, puis autant d'appels de la file :
+            # on ne retire pas d'appels qu'il faudrait remettre faute d'opérateur
+            operateurs = get_connexion().spop(cle_disponibles,taille_lot)
+            if not operateurs :
+                logger.debug("Aucun opérateur disponible (%s)",cle_disponibles)
+                break
+
+            # Un aller-retour : les appels les plus anciens (ZPOPMIN sur une seule partition, sinon
+            # le script qui compare les partitions) et les skills des opérateurs (clés du script d'affectation)
+            pipeline = get_connexion().pipeline(transaction=False)
+            if len(cles_attente) == 1 :
+                pipeline.zpopmin(cles_attente[0],len(operateurs))
+            else :
+                retirer_plus_ancien(get_connexion(),pipeline,cles_attente,len(operateurs))
+            for operateur_id in operateurs:
+                pipeline.hget(Operator.cle(operateur_id),"skills")
+            appels, *skills_operateurs = pipeline.execute()
+            if len(cles_attente) == 1 :
+                appels = [(cles_attente[0],appel_id,score) for appel_id, score in appels]
+            else :
+                appels = [appels[rang:rang + 3] for rang in range(0,len(appels),3)]
+            nombre = len(appels)
+
+            # Les opérateurs en trop restent disponibles, renvoyés avec les scripts du lot
+            pipeline = get_connexion().pipeline(transaction=False)
+            if operateurs[nombre:] :
+                pipeline.sadd(cle_disponibles,*operateurs[nombre:])
+                logger.debug("Aucun appel en attente (%s)",file)
+            lot = []
+            for operateur_id, (cle_attente, appel_id, score), skills in zip(operateurs,appels,skills_operateurs):
+                score = float(score)
+                horodatage, _ = Call.decoder_score_attente(score)
+                cles, arguments = Coordinator.preparer_affectation(appel_id,operateur_id,file,skills or "",horodatage)
+                affecter_appel(get_connexion(),cles,arguments,client=pipeline)
+                lot.append((operateur_id,cle_attente,appel_id,score,horodatage,cles))
+            reponses = pipeline.execute()[-nombre:] if nombre else []
+
+            rejets = get_connexion().pipeline(transaction=False)
+            for (operateur_id, cle_attente, appel_id, score, horodatage, cles), reponse in zip(lot,reponses):
+                resultat = resultat_affectation(reponse,cles)
+                if resultat == ResultatAffectation.DONNEES_MODIFIEES :
+                    # Skills changés depuis la lecture : cette affectation seule est refaite après relecture
+                    resultat = Coordinator.affecter(appel_id,operateur_id,horodatage)
+
+                if resultat in (ResultatAffectation.APPEL_INTROUVABLE,ResultatAffectation.APPEL_DEJA_PRIS) :
+                    # L'appel n'était plus en attente : l'opérateur reste disponible
+                    rejets.sadd(cle_disponibles,operateur_id)
+                    Coordinator.signaler_rejet(resultat,appel_id,operateur_id)
+                    continue
+                if resultat in (ResultatAffectation.OPERATEUR_INTROUVABLE,ResultatAffectation.OPERATEUR_INDISPONIBLE,ResultatAffectation.OPERATEUR_NON_QUALIFIE) :
+                    # L'opérateur n'était plus libre ou plus dans le groupe : l'appel reprend sa place dans la file
+                    rejets.zadd(cle_attente,{appel_id:score})
+                    Coordinator.signaler_rejet(resultat,appel_id,operateur_id)
+                    continue
+
+                affectations.append((appel_id,operateur_id,time.time() - horodatage))
+                logger.debug("Appel %s assigné à l'opérateur %s",appel_id,operateur_id)
+            rejets.execute()
+            # Lot incomplet : plus d'opérateur disponible ou plus d'appel en attente
+            if nombre < taille_lot :
+                break
+
+        return affectations
+
+    @staticmethod
+    def signaler_rejet(resultat,appel_id,operateur_id):
+        """
+        Journalise une affectation refusée par le script : l'appel ou l'opérateur quitte les
+        structures d'attente. Un appel au status 0 avec un opérateur, ou un opérateur au status 0
+        avec un appel, est un enregistrement incohérent (avertissement) : Call.end() libère l'opérateur
+        """
+        if resultat in (ResultatAffectation.APPEL_DEJA_PRIS,ResultatAffectation.OPERATEUR_INDISPONIBLE) :
+            logger.warning("Appel %s, opérateur %s : %s",appel_id,operateur_id,MESSAGES_AFFECTATION[resultat])
+        else :
+            logger.debug("Appel %s, opérateur %s : %s",appel_id,operateur_id,MESSAGES_AFFECTATION[resultat])
+
+    @staticmethod
+    def reconstruire_files():
+        """
+        Reconstruit les index par status des appels et des opérateurs à partir des hashs
+        (pour une base créée avant l'utilisation de ces structures,
+        ou après un changement du nombre de partitions des files d'attente)
+        """
+        # Toutes les files et partitions existantes, quel que soit le nombre de partitions actuel
+        files_existantes = list(get_connexion().scan_iter(match="{}*".format(INDEX_STATUS_APPELS[0])))
+        pipeline = get_connexion().pipeline(transaction=True)
+        pipeline.delete(
+            *INDEX_STATUS_APPELS.values(),*INDEX_STATUS_OPERATEURS.values(),*files_existantes,
+            *[Operator.cle_disponibles(groupe) for groupe in Operator.groupes()],
+        )
+        for appel in Call.iter():
+            if appel['status'] in INDEX_STATUS_APPELS:
+                horodatage = datetime.strptime(appel['creation_time'], "%m/%d/%Y, %H:%M:%S").timestamp()
+                cle_index = INDEX_STATUS_APPELS[appel['status']]
+                if appel['status'] == 0 :
+                    horodatage = Call.score_attente(horodatage,appel['priority'])
+                    cle_index = Call.cle_attente(appel['queue'],Call.partition(appel['id']))
+                    if appel['queue'] :
+                        pipeline.sadd(FILES_APPELS,appel['queue'])
+                pipeline.zadd(cle_index,{appel['id']:horodatage})
+        for operateur in Operator.iter():
+            if operateur['status'] in INDEX_STATUS_OPERATEURS:
+                pipeline.sadd(INDEX_STATUS_OPERATEURS[operateur['status']],operateur['id'])
+            for groupe in operateur['skills']:
+                pipeline.sadd(GROUPES_OPERATEURS,groupe)
+                if operateur['status'] == 0 :
+                    pipeline.sadd(Operator.cle_disponibles(groupe),operateur['id'])
+        pipeline.execute()
+
+    @staticmethod
+    def affecter(appel_id,operateur_id,horodatage=None):
+        """
+        Affecte un appel à un opérateur de façon atomique (script Lua côté serveur).
+        Retourne un ResultatAffectation au lieu de lever une exception
+        """
+        while True:
+            # La file de l'appel et les skills de l'opérateur donnent les clés du script ;
+            # s'ils changent avant le script, on les relit
+            file, skills = Coordinator.lire_affectation(appel_id,operateur_id)
+            resultat = affecter_appel(
+                get_connexion(),*Coordinator.preparer_affectation(appel_id,operateur_id,file,skills,horodatage)
+            )
+            if resultat != ResultatAffectation.DONNEES_MODIFIEES :
+                return resultat
+
+    @staticmethod
+    def lire_affectation(appel_id,operateur_id):
+        """
+        Retourne la file de l'appel et les skills (tels qu'enregistrés) de l'opérateur, en un aller-retour
+        """
+        pipeline = get_connexion().pipeline(transaction=False)
+        pipeline.hget(Call.cle(appel_id),champ("queue"))
+        pipeline.hget(Operator.cle(operateur_id),"skills")
+        file, skills = pipeline.execute()
+        return file or "", skills or ""
+
+    @staticmethod
+    def preparer_affectation(appel_id,operateur_id,file,skills,horodatage=None):
+        """
+        Retourne les KEYS et ARGV du script d'affectation (scripts.SCRIPT_AFFECTATION)
+        pour un appel de la file file et un opérateur de skills skills (chaîne enregistrée) :
+        toutes les clés écrites par le script y figurent
+        """
+        cles = [
+            Call.cle(appel_id),Operator.cle(operateur_id),Call.cle_attente(file,Call.partition(appel_id)),
+            Operator.cle_disponibles(),INDEX_STATUS_APPELS[1],INDEX_STATUS_OPERATEURS[1],
+            CLE_STATISTIQUES,cle_minute(time.time()),
+        ]
+        cles += [Operator.cle_disponibles(groupe) for groupe in Operator._verifier_skills(skills)]
+        arguments = [appel_id,operateur_id,file,skills] + ([horodatage] if horodatage is not None else [])
+        return cles, arguments
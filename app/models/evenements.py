@@ -0,0 +1,54 @@
+"""
+Signalement des événements aux coordinateurs en continu (python -m app.coordinator).
+
+Chaque nouvel appel en attente ou opérateur libéré est publié (PUBLISH) sur le canal
+evenements_coordinateur : tous les coordinateurs abonnés sont réveillés, chacun traite
+ses partitions (voir repartition.py), au lieu d'interroger Redis en boucle.
+Un événement publié quand aucun coordinateur ne tourne est perdu : un coordinateur
+traite de toute façon toutes ses partitions au démarrage.
+"""
+import time
+
+CANAL_EVENEMENTS = "evenements_coordinateur"
+
+NOUVEL_APPEL = "appel"
+OPERATEUR_LIBERE = "operateur"
+
+
+def signaler_coordinateur(pipeline, evenement):
+    """
+    Ajoute au pipeline le signalement d'un événement aux coordinateurs
+    """
+    pipeline.publish(CANAL_EVENEMENTS, evenement)
+
+
+class AbonnementEvenements:
+    """
+    Abonnement d'un coordinateur au canal des événements
+    """
+
+    def __init__(self, connexion):
+        self.pubsub = connexion.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(CANAL_EVENEMENTS)
+
+    def attendre(self, timeout):
+        """
+        Bloque jusqu'au prochain événement (ou timeout secondes).
+        Les événements déjà reçus sont regroupés : un seul passage les traite tous.
+        Retourne le type du premier événement, ou None si le timeout est atteint
+        """
+        fin = time.monotonic() + timeout
+        message = None
+        # get_message retourne None pour les messages ignorés (confirmation d'abonnement)
+        while message is None:
+            restant = fin - time.monotonic()
+            if restant <= 0:
+                return None
+            message = self.pubsub.get_message(timeout=restant)
+
+        while self.pubsub.get_message(timeout=0) is not None:
+            pass
+        return message["data"]
+
+    def fermer(self):
+        self.pubsub.close()
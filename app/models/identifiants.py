@@ -0,0 +1,48 @@
+"""
+Allocation des identifiants des appels et des opérateurs.
+
+Chaque modèle possède une clé compteur dans Redis ; un nouvel identifiant
+est obtenu par un simple INCR, atomique même si plusieurs processus créent
+des objets en même temps.
+"""
+
+# Script Lua : positionne le compteur sur ARGV[1] uniquement s'il est plus grand,
+# pour ne jamais faire reculer un compteur déjà utilisé
+SCRIPT_INITIALISER_COMPTEUR = """
+local actuel = tonumber(redis.call('GET', KEYS[1]) or '0')
+local valeur = tonumber(ARGV[1])
+if valeur > actuel then
+    redis.call('SET', KEYS[1], valeur)
+    return valeur
+end
+return actuel
+"""
+
+
+def generer_identifiant(connexion, cle_compteur):
+    """
+    Retourne un nouvel identifiant unique (un seul aller-retour Redis)
+    """
+    return connexion.incr(cle_compteur)
+
+
+def initialiser_compteur(connexion, cle_identifiants, cle_compteur):
+    """
+    Migration : initialise le compteur à partir des identifiants déjà
+    enregistrés dans le set cle_identifiants.
+    Retourne la valeur du compteur après initialisation.
+    """
+    identifiant_max = 0
+    for identifiant in connexion.sscan_iter(cle_identifiants):
+        identifiant_max = max(identifiant_max, int(identifiant))
+
+    return int(connexion.eval(SCRIPT_INITIALISER_COMPTEUR, 1, cle_compteur, identifiant_max))
+
+
+def generer_identifiants(connexion, cle_compteur, nombre):
+    """
+    Réserve nombre identifiants consécutifs en un seul INCRBY
+    et les retourne sous forme de range
+    """
+    dernier = connexion.incrby(cle_compteur, nombre)
+    return range(dernier - nombre + 1, dernier + 1)
@@ -0,0 +1,239 @@
+"""
+Instrumentation (optionnelle) des modèles : durée de chaque opération,
+commandes Redis et allers-retours qu'elle envoie.
+
+    activer_instrumentation()
+    ...
+    statistiques_instrumentation()   # {"Call.list": {"appels": ..., "commandes": ..., ...}, ...}
+    print(texte_prometheus())        # format texte de Prometheus
+    desactiver_instrumentation()
+
+L'activation remplace les méthodes listées dans OPERATIONS par des versions mesurées, et le
+client partagé (get_connexion()) par un RedisInstrumente (configure(client_class=...)) :
+une commande seule compte un aller-retour, un pipeline exécuté toutes ses commandes en un
+aller-retour, une commande immédiate après WATCH un aller-retour. Les autres clients redis-py
+du processus ne sont pas touchés. La désactivation remet les méthodes originales et le client
+configuré auparavant : désactivée, l'instrumentation ne coûte rien.
+Les commandes sont comptées pour toutes les opérations en cours du thread (une opération
+appelée par une autre compte aussi dans celle-ci) ; les commandes envoyées hors d'une
+opération des modèles ne sont pas comptées. Seuls les modèles synchrones sont instrumentés.
+"""
+import bisect
+import functools
+import threading
+import time
+
+from redis.client import Pipeline, Redis
+
+from . import connexion
+from .call import Call
+from .coordinator import Coordinator
+from .operator import Operator
+
+# Méthodes mesurées, les propriétés le sont à l'écriture (setter)
+OPERATIONS = {
+    Call: [
+        "__init__", "status", "operator_id", "description", "priority", "data", "end", "destroy",
+        "data_by_id", "list", "get_instance_by_id", "get_many", "create_many", "destroy_all",
+        "waiting", "taken", "finished", "compter_par_status", "etat_file_attente", "archive",
+    ],
+    Operator: [
+        "__init__", "status", "call_id", "skills", "data", "destroy",
+        "list", "get_instance_by_id", "get_many", "create_many", "destroy_all", "available", "busy",
+    ],
+    Coordinator: ["assign_all", "assign_partitions", "assign_file", "affecter", "reconstruire_files"],
+}
+
+# Bornes supérieures (secondes) des intervalles de l'histogramme des durées
+INTERVALLES = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class StatistiquesOperation:
+    """
+    Compteurs d'une opération : appels, durée totale, histogramme, commandes, allers-retours
+    """
+
+    def __init__(self):
+        self.appels = 0
+        self.duree_totale = 0.0
+        self.histogramme = [0] * (len(INTERVALLES) + 1)
+        self.commandes = 0
+        self.allers_retours = 0
+
+    def resume(self):
+        cumul = 0
+        histogramme = {}
+        for borne, nombre in zip(INTERVALLES + ("+Inf",), self.histogramme):
+            cumul += nombre
+            histogramme[borne] = cumul
+        return {
+            "appels": self.appels,
+            "duree_totale": self.duree_totale,
+            "commandes": self.commandes,
+            "allers_retours": self.allers_retours,
+            "histogramme": histogramme,
+        }
+
+
+_verrou = threading.Lock()
+_local = threading.local()
+_statistiques = {}
+_originaux = {}
+# Classe du client partagé configurée avant l'activation, remise à la désactivation
+_client_precedent = None
+_actif = False
+
+
+class PipelineInstrumente(Pipeline):
+    """
+    Pipeline du client instrumenté : compte ses exécutions et ses commandes immédiates (après WATCH)
+    """
+
+    def execute(self, raise_on_error=True):
+        _compter(len(self.command_stack))
+        return super().execute(raise_on_error)
+
+    def immediate_execute_command(self, *args, **options):
+        _compter(1)
+        return super().immediate_execute_command(*args, **options)
+
+
+class RedisInstrumente(Redis):
+    """
+    Client redis-py qui compte les commandes et les allers-retours des opérations en cours
+    """
+
+    def execute_command(self, *args, **options):
+        _compter(1)
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return PipelineInstrumente(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def _en_cours():
+    # Pile des opérations en cours dans le thread
+    if not hasattr(_local, "operations"):
+        _local.operations = []
+    return _local.operations
+
+
+def _statistiques_operation(operation):
+    if operation not in _statistiques:
+        _statistiques[operation] = StatistiquesOperation()
+    return _statistiques[operation]
+
+
+def _compter(commandes):
+    operations = _en_cours()
+    if not operations:
+        return
+    with _verrou:
+        for operation in operations:
+            statistiques = _statistiques_operation(operation)
+            statistiques.commandes += commandes
+            statistiques.allers_retours += 1
+
+
+def _mesurer(operation, fonction):
+    @functools.wraps(fonction)
+    def mesuree(*args, **kwargs):
+        operations = _en_cours()
+        operations.append(operation)
+        debut = time.perf_counter()
+        try:
+            return fonction(*args, **kwargs)
+        finally:
+            duree = time.perf_counter() - debut
+            operations.pop()
+            with _verrou:
+                statistiques = _statistiques_operation(operation)
+                statistiques.appels += 1
+                statistiques.duree_totale += duree
+                statistiques.histogramme[bisect.bisect_left(INTERVALLES, duree)] += 1
+    return mesuree
+
+
+def _remplacer(classe, nom, objet):
+    _originaux.setdefault((classe, nom), classe.__dict__[nom])
+    setattr(classe, nom, objet)
+
+
+def activer_instrumentation():
+    """
+    Active l'instrumentation et remet les statistiques à zéro
+    """
+    global _client_precedent, _actif
+    desactiver_instrumentation()
+    with _verrou:
+        _statistiques.clear()
+
+    # Seul le client partagé des modèles est remplacé, recréé à la prochaine utilisation
+    _client_precedent = connexion._parametres.get("client_class")
+    _actif = True
+    connexion._modifier_parametres(client_class=RedisInstrumente)
+
+    for classe, noms in OPERATIONS.items():
+        for nom in noms:
+            attribut = classe.__dict__[nom]
+            operation = "{}.{}".format(classe.__name__, nom)
+            if isinstance(attribut, property):
+                attribut = property(attribut.fget, _mesurer(operation, attribut.fset), attribut.fdel, attribut.__doc__)
+            elif isinstance(attribut, staticmethod):
+                attribut = staticmethod(_mesurer(operation, attribut.__func__))
+            else:
+                attribut = _mesurer(operation, attribut)
+            _remplacer(classe, nom, attribut)
+
+
+def desactiver_instrumentation():
+    """
+    Désactive l'instrumentation (les statistiques restent lisibles)
+    """
+    global _actif
+    if _actif:
+        connexion._modifier_parametres(client_class=_client_precedent)
+        _actif = False
+    while _originaux:
+        (classe, nom), objet = _originaux.popitem()
+        setattr(classe, nom, objet)
+
+
+def statistiques_instrumentation():
+    """
+    Retourne les statistiques par opération : appels, durée totale (secondes),
+    commandes Redis, allers-retours et histogramme cumulé des durées
+    """
+    with _verrou:
+        return {operation: statistiques.resume() for operation, statistiques in _statistiques.items()}
+
+
+def texte_prometheus(prefixe="centre_appels"):
+    """
+    Retourne les statistiques au format texte de Prometheus
+    """
+    lignes = [
+        "# HELP {}_operation_duree_secondes Durée des opérations des modèles".format(prefixe),
+        "# TYPE {}_operation_duree_secondes histogram".format(prefixe),
+    ]
+    statistiques = statistiques_instrumentation()
+    for operation, resume in sorted(statistiques.items()):
+        for borne, nombre in resume["histogramme"].items():
+            lignes.append('{}_operation_duree_secondes_bucket{{operation="{}",le="{}"}} {}'.format(
+                prefixe, operation, borne, nombre))
+        lignes.append('{}_operation_duree_secondes_sum{{operation="{}"}} {}'.format(
+            prefixe, operation, resume["duree_totale"]))
+        lignes.append('{}_operation_duree_secondes_count{{operation="{}"}} {}'.format(
+            prefixe, operation, resume["appels"]))
+
+    for compteur, aide in (
+        ("commandes", "Commandes Redis envoyées par les opérations des modèles"),
+        ("allers_retours", "Allers-retours Redis des opérations des modèles"),
+    ):
+        lignes.append("# HELP {}_redis_{}_total {}".format(prefixe, compteur, aide))
+        lignes.append("# TYPE {}_redis_{}_total counter".format(prefixe, compteur))
+        for operation, resume in sorted(statistiques.items()):
+            lignes.append('{}_redis_{}_total{{operation="{}"}} {}'.format(
+                prefixe, compteur, operation, resume[compteur]))
+
+    return "\n".join(lignes) + "\n"
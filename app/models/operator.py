@@ -1,17 +1,32 @@
 from dataclasses import dataclass
-import redis 
 from .call import *
-
-redis_connexion = redis.Redis(host="localhost",port=6379)
+from .connexion import get_connexion
+from .cache import invalider_local, lire_hashs
+from .session import Session, ecriture
+from .identifiants import generer_identifiant, generer_identifiants, initialiser_compteur
+from .scripts import AffectationImpossible, ResultatAffectation
+from .evenements import OPERATEUR_LIBERE, signaler_coordinateur
+
+# Index des opérateurs par status : 0 libre, 1 au téléphone
+INDEX_STATUS_OPERATEURS = {
+    0:"operateurs_disponibles",
+    1:"operateurs_occupes",
+}
+
+# Groupes (skills) connus : chaque groupe a son set d'opérateurs libres,
+# "operateurs_disponibles :{groupe}", en plus de operateurs_disponibles
+GROUPES_OPERATEURS = "groupes_operateurs"
 
 @dataclass 
 class Operator():
-    def __init__(self,firstname,surname,id=0):
+    def __init__(self,firstname,surname,id=0,skills=()):
         self._id = id
         self._firstname = firstname
         self._surname = surname
         self._status = 0 
         self._call_id = 0
+        # groupes (langues, équipes...) : files d'attente que l'opérateur peut prendre
+        self._skills = Operator._verifier_skills(skills)
 
         self.__post_init__()
 
@@ -24,50 +39,16 @@ class Operator():
         ## Générer l'identifiant 
         # ------------------------------
         if self._id == 0 : 
-            # on récupère l'identifiant du dernier appel 
-            identifiants_operateurs = redis_connexion.smembers("identifiants_operateurs") 
-
-            if len(identifiants_operateurs) != 0 : 
-                # Conversion des valeurs en entiers
-                valeurs_entiers = [int(valeur) for valeur in identifiants_operateurs]
-
-                identifiant_max = max(valeurs_entiers)
+            # INCR atomique sur le compteur : pas de doublon entre plusieurs processus
+            self._id = generer_identifiant(get_connexion(),"compteur_operateurs")
 
-                # le nouvel appel aura l'id le plus élevé de identifiants_appels_entrants + 1
-                self._id = identifiant_max + 1
-            else :
-                self._id = 1 
             # ------------------------------
             ## Enregistrer dans Redis
             # ------------------------------
-            # On vérifie avant que l'objet n'est pas déjà dans Redis : 
-            identifiant_operateur = redis_connexion.smembers("identifiants_operateurs")
-        
-            # on décode le set 
-            identifiant_operateur = {element.decode() for element in identifiant_operateur}
-            
-            if self._id not in identifiant_operateur:
-
-                # On enregistre l'identifiant de l'appel 
-                redis_connexion.sadd("identifiants_operateurs",repr(self._id))
-
-                # Première méthode : utilisant hset 
-
-
-                redis_connexion.hset(
-                    "operateur :{}".format(repr(self._id)),
-                    "firstname",self._firstname.encode()
-                )
-
-                redis_connexion.hset(
-                    "operateur :{}".format(repr(self._id)),
-                    "surname",self._surname.encode()
-                ) 
-
-                redis_connexion.hset(
-                    "operateur :{}".format(repr(self._id)),
-                    "status",self._status 
-                )
+            # SADD + HSET regroupés dans un MULTI/EXEC : un seul aller-retour
+            pipeline = get_connexion().pipeline(transaction=True)
+            self._enregistrer(pipeline)
+            pipeline.execute()
 
         return self
         
@@ -84,10 +65,35 @@ class Operator():
     def status(self,value):
         # Pour assigner un opérateur à un Call 
         self._status = value
-        redis_connexion.hset(
-            "operateur :{}".format(repr(self._id)),
-            "status",value
-        )
+
+        # Le hash et le set des opérateurs disponibles sont mis à jour dans le même MULTI/EXEC
+        with ecriture() as pipeline:
+            self._ecrire_status(pipeline,value)
+
+        return self
+
+    @property
+    def skills(self):
+        return list(self._skills)
+
+    @skills.setter
+    def skills(self,value):
+        # Pour changer les groupes d'un opérateur : un opérateur libre change de sets de disponibilité
+        anciens = self._skills
+        self._skills = Operator._verifier_skills(value)
+
+        with ecriture() as pipeline:
+            pipeline.hset(
+                Operator.cle(self._id),
+                "skills",",".join(self._skills)
+            )
+            for groupe in self._skills:
+                pipeline.sadd(GROUPES_OPERATEURS,groupe)
+            for groupe in anciens:
+                pipeline.srem(Operator.cle_disponibles(groupe),self._id)
+            if int(self._status) == 0 :
+                for groupe in self._skills:
+                    pipeline.sadd(Operator.cle_disponibles(groupe),self._id)
 
         return self
 
@@ -97,40 +103,19 @@ class Operator():
 
     @call_id.setter
     def call_id(self,id_call):
-        # Pour assigner un status à un Call 
-        # Si status = 0, càd que l'opérateur n'a pas d'appels 
-        if self.status == 0 :
-        # Si call_id == 0 : ça que l'opérateur n'a pas d'appels
-            if self.call_id == 0 :
-                # Si le call n'a pas d'opérateurs
-                # cad si call.status == 0 
-
-                details_appel = Call.data_by_id(id_call)
-                
-                # On vérifie si l'appel existe bien 
-                if not details_appel :
-                    raise Exception("L'appel n'a pas été trouvé")
-
-                # Si aucun operateur ou si le status de l'appel n'a pas été défini 
-                if details_appel['operator_id'] == "0" and details_appel['status'] == "0" :
-
-                    # on attribute l'appel à l'opérateur 
-                    self._call_id = id_call
-                    redis_connexion.hset(
-                        "operateur :{}".format(repr(self._id).encode('utf-8')),
-                        "call_id",id_call
-                    )
-
-                    # On attribue ensuite l'opérateur à l'appel 
-                    # TODO 
-
-                else :
-                    raise Exception("L'appel a déjà un opérateur d'affecté.")
-            else :
-                raise Exception("L'opérateur a déjà un appel.")
-        else :
-            raise Exception("L'opérateur n'est pas disponible.")
+        # Pour assigner un appel à l'opérateur 
+        # Les status de l'appel et de l'opérateur sont vérifiés puis écrits
+        # côté serveur par un script Lua, en une seule étape atomique
+        # import local : coordinator.py importe déjà operator.py
+        from .coordinator import Coordinator
+
+        resultat = Coordinator.affecter(id_call,self._id)
 
+        if resultat != ResultatAffectation.AFFECTE :
+            raise AffectationImpossible(resultat)
+
+        self._call_id = id_call
+        self._status = 1
 
         return self
         
@@ -138,103 +123,320 @@ class Operator():
     # Méthodes de l'objet
     # ------------------------------
 
-    def data(self):
+    def _enregistrer(self,pipeline):
+        # Ajoute au pipeline l'enregistrement de l'opérateur : 
+        # l'identifiant dans le set et les caractéristiques dans le hash
+        pipeline.sadd("identifiants_operateurs",self._id)
+        pipeline.hset(
+            Operator.cle(self._id),
+            mapping={
+                "firstname":self._firstname,
+                "surname":self._surname,
+                "status":self._status,
+                "skills":",".join(self._skills),
+            }
+        )
+        for groupe in self._skills:
+            pipeline.sadd(GROUPES_OPERATEURS,groupe)
+        # L'opérateur est rangé dans l'index de son status, libre il est disponible pour le coordinateur
+        # (dans operateurs_disponibles et dans le set de chacun de ses groupes)
+        pipeline.sadd(INDEX_STATUS_OPERATEURS[int(self._status)],self._id)
+        if int(self._status) == 0 :
+            for groupe in self._skills:
+                pipeline.sadd(Operator.cle_disponibles(groupe),self._id)
+            signaler_coordinateur(pipeline,OPERATEUR_LIBERE)
+
+    def batch(self,surveiller=False):
         """
-        Retourne les caractéristiques de l'appel
+        Ouvre une session regroupant les écritures des setters dans un seul MULTI/EXEC,
+        avec surveiller=True le hash de l'opérateur est surveillé par WATCH
         """
+        return Session(surveiller=[self] if surveiller else ())
 
-        details_operateur = redis_connexion.hgetall("operateur :{}".format(self._id))
-
-        details_operateur = {key.decode(): value.decode() for key, value in details_operateur.items()}
+    def _ecrire_status(self,pipeline,value):
+        # Ajoute au pipeline l'écriture du status et le déplacement de l'opérateur
+        # vers l'index de son nouveau status
+        pipeline.hset(
+            Operator.cle(self._id),
+            "status",value
+        )
+        if int(value) == 0 :
+            # Libre, l'opérateur n'a plus d'appel : sinon le script d'affectation le refuse.
+            # Pour terminer un appel et libérer son opérateur, Call.end()
+            self._call_id = 0
+            pipeline.hset(Operator.cle(self._id),"call_id",0)
+        for status, cle_index in INDEX_STATUS_OPERATEURS.items():
+            if status == int(value) :
+                pipeline.sadd(cle_index,self._id)
+            else :
+                pipeline.srem(cle_index,self._id)
+        for groupe in self._skills:
+            if int(value) == 0 :
+                pipeline.sadd(Operator.cle_disponibles(groupe),self._id)
+            else :
+                pipeline.srem(Operator.cle_disponibles(groupe),self._id)
+        if int(value) == 0 :
+            signaler_coordinateur(pipeline,OPERATEUR_LIBERE)
 
-        details_operateur['id'] = self._id # on ajoute l'identifiant au dictionnaire 
+    def data(self):
+        """
+        Retourne les caractéristiques de l'appel
+        """
+        details_operateur = lire_hashs([Operator.cle(self._id)])[0]
 
-        return details_operateur
+        return Operator.hydrater(self._id,details_operateur)
 
     def destroy(self):
         """
         Supprime un appel 
         """
+        pipeline = get_connexion().pipeline(transaction=True)
+
         # supprimer l'élément id du set redis 
-        result = redis_connexion.srem("identifiants_operateurs",self._id) #TODO : Raise an exception
+        pipeline.srem("identifiants_operateurs",self._id) #TODO : Raise an exception
 
         # supprimer le hachage Redis contenant les caractéristiques de l'appel 
-        redis_connexion.delete("operateur :{}".format(self._id))
+        pipeline.delete(Operator.cle(self._id))
+
+        # retirer l'opérateur des index par status 
+        for cle_index in INDEX_STATUS_OPERATEURS.values():
+            pipeline.srem(cle_index,self._id)
+        for groupe in self._skills:
+            pipeline.srem(Operator.cle_disponibles(groupe),self._id)
+        pipeline.execute()
+        invalider_local([Operator.cle(self._id)])
         del self 
 
     # ------------------------------
     # Méthodes statiques
     # ------------------------------
 
+    @staticmethod
+    def cle(identifiant):
+        """
+        Retourne la clé du hash Redis contenant les caractéristiques d'un opérateur
+        """
+        return "operateur :{}".format(identifiant)
+
+    @staticmethod
+    def cle_disponibles(groupe=""):
+        """
+        Retourne la clé du set des opérateurs libres du groupe,
+        operateurs_disponibles (tous les opérateurs libres) sans groupe
+        """
+        return "{} :{}".format(INDEX_STATUS_OPERATEURS[0],groupe) if groupe else INDEX_STATUS_OPERATEURS[0]
+
+    @staticmethod
+    def groupes():
+        """
+        Retourne les groupes (skills) connus des opérateurs
+        """
+        return sorted(get_connexion().smembers(GROUPES_OPERATEURS))
+
+    @staticmethod
+    def _verifier_skills(skills):
+        # Les skills sont enregistrés dans le hash séparés par des virgules
+        if isinstance(skills,str) :
+            skills = skills.split(",")
+        skills = [str(groupe) for groupe in skills if groupe]
+        for groupe in skills:
+            if "," in groupe :
+                raise Exception("Le nom d'un groupe ne peut pas contenir de virgule.")
+        return skills
+
+    @staticmethod
+    def hydrater(identifiant,details_operateur):
+        """
+        Convertit le hash Redis d'un opérateur (déjà décodé par la connexion)
+        en dictionnaire typé : seul endroit où les champs sont convertis
+        """
+        details_operateur["id"] = identifiant # on ajoute l'identifiant au dictionnaire
+        details_operateur["status"] = int(details_operateur.get("status",0))
+        details_operateur["call_id"] = int(details_operateur.get("call_id",0))
+        details_operateur["skills"] = Operator._verifier_skills(details_operateur.get("skills",""))
+        return details_operateur
+
     @staticmethod
     def list_id():
         """
         Liste tous les identifiants des appels enregistrés dans Redis,
         enregistrés dans le set identifiants_appels_entrants
         """
-        return [identifiant.decode() for identifiant in redis_connexion.smembers("identifiants_operateurs")]
+        return list(get_connexion().smembers("identifiants_operateurs"))
 
     @staticmethod
-    def list():
+    def list(taille_lot=1000):
         """
         Liste tous les opérateurs ainsi que leurs descriptions,
-        enregistrés dans le hash Redis operateur + id
+        enregistrés dans le hash Redis operateur + id.
+        Construit la liste complète en mémoire : pour de gros volumes, utiliser Operator.iter()
         """
-        operateurs = []
-        identifiants_operateurs = redis_connexion.smembers("identifiants_operateurs")
-        for identifiant in identifiants_operateurs:
-            details_operateur = redis_connexion.hgetall("operateur :{}".format(identifiant))
+        return list(Operator.iter(taille_lot))
 
-            # Convertir les clés et les valeurs en chaînes de caractères
-            details_operateur = {key.decode(): value.decode() for key, value in details_operateur.items()}
+    @staticmethod
+    def iter(taille_lot=1000):
+        """
+        Générateur parcourant les opérateurs un par un, sans charger tout le set :
+        les identifiants sont lus par SSCAN et les hashs par lots de taille_lot
+        dans un pipeline, la mémoire utilisée reste bornée par taille_lot.
+        Comme tout SCAN, un élément peut être retourné deux fois si le set
+        est modifié pendant le parcours
+        """
+        lot = []
+        for identifiant in get_connexion().sscan_iter("identifiants_operateurs",count=taille_lot):
+            lot.append(identifiant)
+            if len(lot) == taille_lot :
+                yield from Operator._lire_lot(lot)
+                lot = []
 
-            details_operateur["id"] = identifiant.decode()  # on ajoute l'identifiant au dictionnaire
-            operateurs.append(details_operateur)
+        if lot :
+            yield from Operator._lire_lot(lot)
 
-        return operateurs
+    @staticmethod
+    def _lire_lot(identifiants):
+        # Lit les hashs d'un lot d'identifiants en un seul aller-retour (ou depuis le cache)
+        hashs = lire_hashs([Operator.cle(identifiant) for identifiant in identifiants])
+        # L'opérateur a pu être supprimé entre SSCAN et HGETALL : hash vide ignoré
+        return [
+            Operator.hydrater(identifiant,details_operateur)
+            for identifiant, details_operateur in zip(identifiants,hashs)
+            if details_operateur
+        ]
 
     @staticmethod
-    def destroy_all():
+    def destroy_all(taille_lot=1000):
         """
         Supprime tous les opérateurs : 
         - Dans le set identifiants_operateurs contenant les id 
         - Dans le hash operateur contenant les détails des opérateurs 
+        Les identifiants sont lus par SSCAN et les hashs supprimés par UNLINK,
+        taille_lot clés par commande. Retourne le nombre d'opérateurs supprimés
         """
-        # On récupère tous les identifiants enregistrés 
-        all_keys = Operator.list_id()
+        nombre = 0
+        lot = []
+        for identifiant in get_connexion().sscan_iter("identifiants_operateurs",count=taille_lot):
+            lot.append(Operator.cle(identifiant))
+            if len(lot) == taille_lot :
+                # UNLINK retourne le nombre de clés supprimées : un doublon de SSCAN n'est pas compté
+                nombre += get_connexion().unlink(*lot)
+                lot = []
+        if lot :
+            nombre += get_connexion().unlink(*lot)
+
+        # le set des identifiants et les index par status sont supprimés d'un coup
+        get_connexion().unlink(
+            "identifiants_operateurs",
+            *INDEX_STATUS_OPERATEURS.values(),
+            *[Operator.cle_disponibles(groupe) for groupe in Operator.groupes()],
+            GROUPES_OPERATEURS,
+        )
+        invalider_local()
+        return nombre
 
-        # Parcourir les clés et supprimer les hachages redis 
-        for key in all_keys:
-            # on supprime l'identifiant du set contenant les identifiants 
-            redis_connexion.srem("identifiants_operateurs",key)
+    @staticmethod
+    def create_many(rows,taille_lot=1000,skills=()):
+        """
+        Crée un opérateur par couple (firstname, surname), tous avec les groupes skills, et les enregistre
+        dans Redis par lots de taille_lot opérateurs (un MULTI/EXEC par lot).
+        Retourne la liste des objets Operator créés
+        """
+        rows = list(rows)
+        if not rows :
+            return []
 
-            # on supprime les éléments du hash contenant les détails de l'appel 
-            redis_connexion.delete("operateur :{}".format(key))
+        # Un seul INCRBY pour réserver tous les identifiants
+        identifiants = generer_identifiants(get_connexion(),"compteur_operateurs",len(rows))
+
+        # Un identifiant non nul évite l'enregistrement dans __post_init__
+        operateurs = [Operator(firstname,surname,id=identifiant,skills=skills) for (firstname, surname), identifiant in zip(rows,identifiants)]
+
+        for debut in range(0,len(operateurs),taille_lot):
+            pipeline = get_connexion().pipeline(transaction=True)
+            for operateur in operateurs[debut:debut+taille_lot]:
+                operateur._enregistrer(pipeline)
+            pipeline.execute()
+
+        return operateurs
 
     @staticmethod
-    def get_instance_by_id(identifiant):
+    def par_status(status,limit=None,groupe=""):
         """
-        Retourne un objet Operateur pour un identifiant donné
+        Liste les opérateurs d'un status donné (au plus limit opérateurs),
+        en ne lisant que les hashs de ces opérateurs.
+        Pour les opérateurs libres, groupe limite la liste à ceux de ce groupe
         """
-        identifiant_operateur= Operator.list_id()
+        cle_index = Operator.cle_disponibles(groupe) if int(status) == 0 else INDEX_STATUS_OPERATEURS[int(status)]
+        if limit is None :
+            identifiants = list(get_connexion().smembers(cle_index))
+        else :
+            identifiants = []
+            for identifiant in get_connexion().sscan_iter(cle_index,count=limit):
+                identifiants.append(identifiant)
+                if len(identifiants) == limit :
+                    break
+        return Operator._lire_lot(identifiants)
 
-        if identifiant in identifiant_operateur:
+    @staticmethod
+    def available(limit=None,groupe=""):
+        """
+        Liste les opérateurs libres (status 0), ou seulement ceux du groupe
+        """
+        return Operator.par_status(0,limit,groupe)
 
-            details_operateur = redis_connexion.hgetall("operateur :{}".format(identifiant))
-            firstname = details_operateur.get(b"firstname", b"").decode()
-            surname = details_operateur.get(b"surname", b"").decode()
+    @staticmethod
+    def busy(limit=None):
+        """
+        Liste les opérateurs au téléphone (status 1)
+        """
+        return Operator.par_status(1,limit)
 
-            # Créer une nouvelle instance d'opérateur avec les informations récupérées
-            instance = Operator(firstname, surname,id=identifiant)
+    @staticmethod
+    def migrer_compteur():
+        """
+        Initialise le compteur d'identifiants à partir des opérateurs déjà enregistrés
+        (à lancer une fois sur une base créée avant l'utilisation du compteur)
+        """
+        return initialiser_compteur(get_connexion(),"identifiants_operateurs","compteur_operateurs")
 
-            # Récupérer et assigner les autres attributs de l'opérateur (status, call_id, etc.)
-            instance._status = int(details_operateur.get(b"status", 0))
-            instance._call_id = int(details_operateur.get(b"call_id", 0))
+    @staticmethod
+    def get_instance_by_id(identifiant):
+        """
+        Retourne un objet Operateur pour un identifiant donné
+        """
+        # Un seul HGETALL : un hash vide veut dire que l'opérateur n'existe pas
+        details_operateur = lire_hashs([Operator.cle(identifiant)])[0]
 
-            return instance
+        if details_operateur :
+            return Operator._instance(Operator.hydrater(identifiant,details_operateur))
 
         raise Exception("L'opérateur n'existe pas. ")
 
+    @staticmethod
+    def get_many(identifiants):
+        """
+        Retourne les objets Operator pour plusieurs identifiants en un seul aller-retour,
+        dans le même ordre, avec None pour un opérateur qui n'existe pas
+        """
+        identifiants = list(identifiants)
+        hashs = lire_hashs([Operator.cle(identifiant) for identifiant in identifiants])
+        return [
+            Operator._instance(Operator.hydrater(identifiant,details_operateur)) if details_operateur else None
+            for identifiant, details_operateur in zip(identifiants,hashs)
+        ]
+
+    @staticmethod
+    def _instance(details_operateur,classe=None):
+        # Crée l'objet Operator (ou classe, AsyncOperator) à partir d'un hash hydraté, sans passer par __init__ :
+        # __post_init__ (génération de l'identifiant, enregistrement) n'est pas relancé
+        instance = object.__new__(classe or Operator)
+        instance._id = details_operateur["id"]
+        instance._firstname = details_operateur.get("firstname","")
+        instance._surname = details_operateur.get("surname","")
+        instance._status = details_operateur["status"]
+        instance._call_id = details_operateur["call_id"]
+        instance._skills = details_operateur.get("skills",[])
+        return instance
+
 
 if __name__ == '__main__' : 
     operateur = Operator("Alexis","Dubanchet")
@@ -0,0 +1,85 @@
+"""
+Répartition des files d'attente entre plusieurs coordinateurs (python -m app.coordinator --processus N,
+ou plusieurs lancements sur une ou plusieurs machines).
+
+Les files d'attente sont découpées en partitions (REDIS_PARTITIONS_ATTENTE, voir stockage.py) :
+une partition est un couple (file, numéro), un sorted set appels_en_attente[ :{file}] #{numéro}.
+
+Chaque coordinateur s'inscrit dans le sorted set coordinateurs avec un bail
+(score = fin du bail en millisecondes, horloge du serveur Redis) qu'il renouvelle
+à chaque tour de boucle ; un coordinateur arrêté ou bloqué perd son bail après DUREE_BAIL secondes.
+Chaque partition revient au coordinateur actif de plus grand hash(nom, file, numéro)
+(rendezvous hashing) : chaque coordinateur calcule seul ses partitions, et quand un coordinateur
+apparaît ou disparaît, seules les partitions qu'il prend ou qu'il avait changent de main.
+
+Pendant un changement, deux coordinateurs peuvent traiter brièvement la même partition :
+c'est sans risque, ZPOPMIN / SPOP et le script d'affectation empêchent toute double affectation.
+Les opérateurs disponibles ne sont pas partitionnés : un opérateur libre sert n'importe quelle partition.
+"""
+import hashlib
+import os
+import socket
+
+from .call import Call
+from .connexion import get_connexion
+from .scripts import renouveler_bail
+from .stockage import nombre_partitions
+
+CLE_COORDINATEURS = "coordinateurs"
+
+# Secondes sans renouvellement avant qu'un coordinateur soit considéré comme arrêté
+DUREE_BAIL = 15.0
+
+
+def nom_coordinateur():
+    """
+    Retourne un nom de coordinateur unique : machine et numéro de processus
+    """
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def _poids(nom, file, partition):
+    return hashlib.sha1("{}|{}|{}".format(nom, file, partition).encode()).digest()
+
+
+def proprietaire(file, partition, coordinateurs):
+    """
+    Retourne le coordinateur (parmi coordinateurs) qui traite la partition de la file
+    """
+    return max(coordinateurs, key=lambda nom: _poids(nom, file, partition))
+
+
+class Bail:
+    """
+    Inscription d'un coordinateur parmi les coordinateurs actifs
+    """
+
+    def __init__(self, nom=None, duree=DUREE_BAIL):
+        self.nom = nom or nom_coordinateur()
+        self.duree = duree
+        self.coordinateurs = []
+
+    def renouveler(self):
+        """
+        Prolonge le bail et retourne la liste des coordinateurs actifs
+        """
+        self.coordinateurs = sorted(renouveler_bail(get_connexion(), CLE_COORDINATEURS, self.nom, self.duree))
+        return self.coordinateurs
+
+    def partitions(self):
+        """
+        Renouvelle le bail et retourne les partitions (file, numéro) du coordinateur
+        """
+        coordinateurs = self.renouveler()
+        return [
+            (file, partition)
+            for file in Call.files()
+            for partition in range(nombre_partitions())
+            if proprietaire(file, partition, coordinateurs) == self.nom
+        ]
+
+    def liberer(self):
+        """
+        Quitte les coordinateurs actifs : les partitions sont reprises sans attendre l'expiration
+        """
+        get_connexion().zrem(CLE_COORDINATEURS, self.nom)
@@ -0,0 +1,343 @@
+"""
+Scripts Lua exécutés côté serveur Redis.
+
+Les scripts sont enregistrés une fois par connexion puis appelés par EVALSHA
+(redis-py recharge automatiquement un script absent du cache du serveur).
+"""
+from enum import IntEnum
+from string import Template
+
+from .cache import invalider_local
+
+from .statistiques import LUA_STATISTIQUES, RETENTION_STATISTIQUES
+from .stockage import champ, compact
+
+
+class ResultatAffectation(IntEnum):
+    """
+    Résultat de l'affectation d'un appel à un opérateur
+    """
+    AFFECTE = 0
+    APPEL_INTROUVABLE = 1
+    OPERATEUR_INTROUVABLE = 2
+    APPEL_DEJA_PRIS = 3
+    OPERATEUR_INDISPONIBLE = 4
+    OPERATEUR_NON_QUALIFIE = 5
+    DONNEES_MODIFIEES = 6
+
+
+MESSAGES_AFFECTATION = {
+    ResultatAffectation.APPEL_INTROUVABLE: "L'appel n'a pas été trouvé",
+    ResultatAffectation.OPERATEUR_INTROUVABLE: "L'opérateur n'existe pas.",
+    ResultatAffectation.APPEL_DEJA_PRIS: "L'appel a déjà un opérateur d'affecté.",
+    ResultatAffectation.OPERATEUR_INDISPONIBLE: "L'opérateur n'est pas disponible.",
+    ResultatAffectation.OPERATEUR_NON_QUALIFIE: "L'opérateur n'a pas le groupe de la file de l'appel.",
+    ResultatAffectation.DONNEES_MODIFIEES: "La file de l'appel ou les groupes de l'opérateur ont changé.",
+}
+
+
+class AffectationImpossible(Exception):
+    """
+    Levée quand un appel ne peut pas être affecté à un opérateur,
+    l'attribut resultat précise la raison
+    """
+    def __init__(self, resultat):
+        self.resultat = resultat
+        super().__init__(MESSAGES_AFFECTATION.get(resultat, resultat.name))
+
+
+# KEYS : hash de l'appel, hash de l'opérateur, file d'attente de l'appel (sa partition),
+#        operateurs_disponibles, appels_pris, operateurs_occupes, statistiques_appels,
+#        statistiques_appels de la minute, puis operateurs_disponibles de chaque groupe de l'opérateur
+# ARGV : id de l'appel, id de l'opérateur, file de l'appel et skills de l'opérateur lus par le client,
+#        creation_time de l'appel (optionnel, déduit du score dans la file d'attente sinon)
+# Vérifie les deux status et le groupe de l'opérateur pour la file de l'appel,
+# puis écrit les deux hashs (et l'heure de l'affectation) en une seule étape atomique,
+# et compte l'affectation et l'attente de l'appel dans les statistiques.
+# Le script n'écrit que des clés de KEYS : le client les déduit de la file et des skills
+# qu'il a lus (voir Coordinator.preparer_affectation), le script retourne 6 s'ils ont changé depuis
+SCRIPT_AFFECTATION = LUA_STATISTIQUES + """
+-- Un hash sans status n'existe pas : un HMGET par hash suffit
+local appel = redis.call('HMGET', KEYS[1], '$status', '$operator_id', '$queue')
+if not appel[1] then return 1 end
+local operateur = redis.call('HMGET', KEYS[2], 'status', 'call_id', 'skills')
+if not operateur[1] then return 2 end
+
+if appel[1] ~= '0' or (appel[2] and appel[2] ~= '0') then return 3 end
+if operateur[1] ~= '0' or (operateur[2] and operateur[2] ~= '0') then return 4 end
+
+local file = appel[3] or ''
+if file ~= ARGV[3] or (operateur[3] or '') ~= ARGV[4] then return 6 end
+if file ~= '' and not string.find(',' .. ARGV[4] .. ',', ',' .. file .. ',', 1, true) then return 5 end
+
+local score = ARGV[5]
+if not score then
+    -- score de la file d'attente = creation_time - priorité * 1e10 (Call.score_attente)
+    local attente = redis.call('ZSCORE', KEYS[3], ARGV[1])
+    if attente then
+        attente = tonumber(attente)
+        score = attente - math.floor(attente / 1e10) * 1e10
+    else
+        score = redis.call('TIME')[1]
+    end
+end
+score = tonumber(score)
+
+local maintenant = horloge()
+redis.call('HSET', KEYS[1], '$status', 1, '$operator_id', ARGV[2], '$assign_time', maintenant)
+redis.call('HSET', KEYS[2], 'status', 1, 'call_id', ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('SREM', KEYS[4], ARGV[2])
+for rang = 9, #KEYS do
+    redis.call('SREM', KEYS[rang], ARGV[2])
+end
+redis.call('ZADD', KEYS[5], score, ARGV[1])
+redis.call('SADD', KEYS[6], ARGV[2])
+compter(KEYS[7], KEYS[8], 'affectes', 'attente_totale', math.max(0, maintenant - score))
+return 0
+"""
+
+_scripts = {}
+_sources = {}
+
+
+def _source(script):
+    # Les scripts désignent les champs du hash de l'appel par $status, $operator_id, $queue, $assign_time :
+    # remplacés par leur nom dans la disposition courante (voir stockage.py)
+    disposition = (script, compact())
+    if disposition not in _sources:
+        _sources[disposition] = Template(script).substitute(
+            status=champ("status"), operator_id=champ("operator_id"), queue=champ("queue"),
+            assign_time=champ("assign_time"), retention=RETENTION_STATISTIQUES,
+        )
+    return _sources[disposition]
+
+
+def _script(connexion, script):
+    # Un objet Script par connexion et par source : le SHA1 n'est calculé qu'une fois
+    source = _source(script)
+    if (connexion, source) not in _scripts:
+        _scripts[(connexion, source)] = connexion.register_script(source)
+    return _scripts[(connexion, source)]
+
+
+def charger_scripts(connexion):
+    """
+    Charge les scripts dans le cache du serveur (SCRIPT LOAD),
+    à appeler au démarrage de l'application
+    """
+    for script in (SCRIPT_AFFECTATION, SCRIPT_FIN_APPEL, SCRIPT_BAIL, SCRIPT_PLUS_ANCIEN):
+        connexion.script_load(_source(script))
+        _script(connexion, script)
+
+
+# KEYS : partitions d'une file d'attente (sorted sets, score = Call.score_attente)
+# ARGV : nombre d'appels à retirer
+# Retire les ARGV[1] appels de plus petit score (les plus prioritaires, puis les plus anciens)
+# parmi les partitions. Retourne {clé de sa partition, id, score, ...} dans l'ordre de service,
+# une liste vide si toutes les partitions sont vides
+SCRIPT_PLUS_ANCIEN = """
+local nombre = tonumber(ARGV[1])
+local candidats = {}
+for _, cle in ipairs(KEYS) do
+    local tete = redis.call('ZRANGE', cle, 0, nombre - 1, 'WITHSCORES')
+    for rang = 1, #tete, 2 do
+        table.insert(candidats, {cle, tete[rang], tete[rang + 1], tonumber(tete[rang + 1]), #candidats})
+    end
+end
+-- À score égal, l'ordre des partitions et de chaque partition est gardé
+table.sort(candidats, function(a, b) return a[4] < b[4] or (a[4] == b[4] and a[5] < b[5]) end)
+
+local resultat, retires = {}, {}
+for rang = 1, math.min(nombre, #candidats) do
+    local cle, appel_id, score = candidats[rang][1], candidats[rang][2], candidats[rang][3]
+    retires[cle] = retires[cle] or {}
+    table.insert(retires[cle], appel_id)
+    table.insert(resultat, cle)
+    table.insert(resultat, appel_id)
+    table.insert(resultat, score)
+end
+for cle, identifiants in pairs(retires) do
+    redis.call('ZREM', cle, unpack(identifiants))
+end
+return resultat
+"""
+
+
+def retirer_plus_ancien(connexion, pipeline, cles_attente, nombre=1):
+    """
+    Ajoute au pipeline (de connexion) le retrait des nombre appels à servir en premier
+    parmi les partitions cles_attente, voir SCRIPT_PLUS_ANCIEN
+    """
+    _script(connexion, SCRIPT_PLUS_ANCIEN)(keys=cles_attente, args=[nombre], client=pipeline)
+
+
+async def retirer_plus_ancien_async(connexion, pipeline, cles_attente, nombre=1):
+    """
+    Version asyncio de retirer_plus_ancien, pour un pipeline redis.asyncio
+    """
+    await _script(connexion, SCRIPT_PLUS_ANCIEN)(keys=cles_attente, args=[nombre], client=pipeline)
+
+
+def affecter_appel(connexion, cles, arguments, client=None):
+    """
+    Affecte atomiquement un appel à un opérateur ; cles et arguments sont les KEYS et ARGV
+    de SCRIPT_AFFECTATION (voir Coordinator.preparer_affectation).
+    Retourne un ResultatAffectation, ou avec client (un pipeline de connexion) ajoute
+    seulement le script au pipeline : sa réponse passe ensuite par resultat_affectation
+    """
+    resultat = _script(connexion, SCRIPT_AFFECTATION)(keys=cles, args=arguments, client=client)
+    if client is None:
+        return resultat_affectation(resultat, cles)
+
+
+async def affecter_appel_async(connexion, cles, arguments):
+    """
+    Version asyncio de affecter_appel, pour une connexion redis.asyncio
+    """
+    resultat = await _script(connexion, SCRIPT_AFFECTATION)(keys=cles, args=arguments)
+    return resultat_affectation(resultat, cles)
+
+
+def resultat_affectation(resultat, cles):
+    """
+    Retourne le ResultatAffectation de la réponse du script ;
+    les hashs de l'appel et de l'opérateur (cles) quittent le cache local
+    """
+    invalider_local(cles[:2])
+    return ResultatAffectation(int(resultat))
+
+
+class ResultatFinAppel(IntEnum):
+    """
+    Résultat de la fin d'un appel
+    """
+    TERMINE = 0
+    APPEL_INTROUVABLE = 1
+    DONNEES_MODIFIEES = 2
+
+
+class FinAppelImpossible(Exception):
+    """
+    Levée quand un appel ne peut pas être terminé, l'attribut resultat précise la raison
+    """
+    def __init__(self, resultat):
+        self.resultat = resultat
+        super().__init__("L'appel n'existe pas." if resultat == ResultatFinAppel.APPEL_INTROUVABLE else resultat.name)
+
+
+# KEYS : hash de l'appel, identifiants_appels_entrants, file d'attente de l'appel (sa partition),
+#        appels_pris, appels_termines, archive_appels, operateurs_disponibles, operateurs_occupes,
+#        canal evenements_coordinateur, statistiques_appels, statistiques_appels de la minute,
+#        statistiques_operateurs, puis si l'appel a un opérateur : hash de l'opérateur
+#        et operateurs_disponibles de chacun de ses groupes
+# ARGV : id de l'appel, id de son opérateur ('0' sans opérateur), file de l'appel
+#        et skills de l'opérateur, lus par le client (voir Call.preparer_fin)
+# Libère l'opérateur, marque l'appel terminé puis le déplace dans le stream d'archive :
+# l'appel quitte les structures de travail (hash, set des identifiants, index par status).
+# La fin et la durée depuis l'affectation sont comptées dans les statistiques.
+# Retourne {résultat, id de l'opérateur de l'appel ('0' sans opérateur)},
+# résultat 2 si l'opérateur, la file ou les skills lus par le client ont changé depuis
+SCRIPT_FIN_APPEL = LUA_STATISTIQUES + """
+-- Le hash complet sert aux vérifications puis à l'archive
+local champs = redis.call('HGETALL', KEYS[1])
+if #champs == 0 then return {1, '0'} end
+local appel = {}
+for rang = 1, #champs, 2 do appel[champs[rang]] = champs[rang + 1] end
+
+local operateur_id = appel['$operator_id'] or '0'
+if operateur_id ~= ARGV[2] or (appel['$queue'] or '') ~= ARGV[3] then
+    return {2, operateur_id}
+end
+local operateur = {}
+if operateur_id ~= '0' then
+    operateur = redis.call('HMGET', KEYS[13], 'skills', 'call_id')
+    if (operateur[1] or '') ~= ARGV[4] then return {2, operateur_id} end
+end
+
+local maintenant = horloge()
+local affectation = appel['$assign_time']
+local duree = affectation and math.max(0, maintenant - tonumber(affectation)) or 0
+if affectation then
+    compter(KEYS[10], KEYS[11], 'termines', 'duree_totale', duree)
+else
+    compter(KEYS[10], KEYS[11], 'abandonnes')
+end
+
+if operateur_id ~= '0' then
+    redis.call('HINCRBY', KEYS[12], operateur_id .. ':appels', 1)
+    redis.call('HINCRBYFLOAT', KEYS[12], operateur_id .. ':duree', duree)
+    -- L'opérateur n'est libéré que s'il est bien sur cet appel
+    if operateur[2] == ARGV[1] then
+        redis.call('HSET', KEYS[13], 'status', 0, 'call_id', 0)
+        redis.call('SREM', KEYS[8], operateur_id)
+        redis.call('SADD', KEYS[7], operateur_id)
+        for rang = 14, #KEYS do
+            redis.call('SADD', KEYS[rang], operateur_id)
+        end
+        redis.call('PUBLISH', KEYS[9], 'operateur')
+    end
+end
+
+-- L'appel est archivé au status 2
+for rang = 1, #champs, 2 do
+    if champs[rang] == '$status' then champs[rang + 1] = '2' end
+end
+table.insert(champs, 'id')
+table.insert(champs, ARGV[1])
+table.insert(champs, 'fin')
+table.insert(champs, math.floor(maintenant))
+redis.call('XADD', KEYS[6], '*', unpack(champs))
+
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('ZREM', KEYS[5], ARGV[1])
+return {0, operateur_id}
+"""
+
+
+def _resultat_fin_appel(resultat, cles):
+    # Les hashs de l'appel et de son opérateur (s'il en a un) quittent le cache local
+    invalider_local(cles[:1] + cles[12:13])
+    return ResultatFinAppel(int(resultat[0]))
+
+
+def terminer_appel(connexion, cles, arguments):
+    """
+    Termine et archive atomiquement un appel en libérant son opérateur ; cles et arguments
+    sont les KEYS et ARGV de SCRIPT_FIN_APPEL (voir Call.preparer_fin).
+    Retourne un ResultatFinAppel
+    """
+    resultat = _script(connexion, SCRIPT_FIN_APPEL)(keys=cles, args=arguments)
+    return _resultat_fin_appel(resultat, cles)
+
+
+async def terminer_appel_async(connexion, cles, arguments):
+    """
+    Version asyncio de terminer_appel, pour une connexion redis.asyncio
+    """
+    resultat = await _script(connexion, SCRIPT_FIN_APPEL)(keys=cles, args=arguments)
+    return _resultat_fin_appel(resultat, cles)
+
+
+# KEYS : coordinateurs (sorted set, score = fin du bail en millisecondes)
+# ARGV : nom du coordinateur, durée du bail en millisecondes
+# Retire les coordinateurs dont le bail a expiré, prolonge celui du coordinateur
+# et retourne les coordinateurs actifs ; l'horloge est celle du serveur Redis
+SCRIPT_BAIL = """
+local temps = redis.call('TIME')
+local maintenant = tonumber(temps[1]) * 1000 + math.floor(tonumber(temps[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', maintenant)
+redis.call('ZADD', KEYS[1], maintenant + tonumber(ARGV[2]), ARGV[1])
+return redis.call('ZRANGE', KEYS[1], 0, -1)
+"""
+
+
+def renouveler_bail(connexion, cle_coordinateurs, nom, duree):
+    """
+    Prolonge de duree secondes le bail du coordinateur nom.
+    Retourne la liste des coordinateurs actifs (nom compris)
+    """
+    return _script(connexion, SCRIPT_BAIL)(keys=[cle_coordinateurs], args=[nom, int(duree * 1000)])
@@ -0,0 +1,104 @@
+"""
+Regroupement des écritures des setters (unité de travail).
+
+Par défaut chaque setter (Call.status, Call.description, Call.operator_id,
+Operator.status) écrit immédiatement dans Redis. Dans une session, les écritures
+de tous les objets Call et Operator du thread sont mises en attente puis envoyées
+dans un seul MULTI/EXEC à la sortie du bloc :
+
+    with Session():
+        appel.description = "..."
+        appel.priority = 2
+        operateur.skills = ["anglais"]
+
+    with appel.batch(surveiller=True):   # WATCH sur le hash de l'appel
+        ...
+
+Avec surveiller, les clés des objets sont surveillées (WATCH) dès l'entrée dans
+le bloc : si un autre client les modifie avant la fin, rien n'est écrit et
+redis.exceptions.WatchError est levée, à l'appelant de recommencer.
+Si une exception sort du bloc, les écritures en attente sont abandonnées.
+Les attributs des objets Python, eux, sont modifiés immédiatement.
+
+Operator.call_id n'est pas concerné : son script Lua doit lire l'état courant.
+De même, un appel se termine et son opérateur se libère par Call.end() (script Lua),
+pas par les setters status dans une session.
+"""
+import threading
+from contextlib import contextmanager
+
+from .cache import cles_suivies, invalider_local
+from .connexion import get_connexion
+
+_local = threading.local()
+
+
+class Session:
+
+    def __init__(self, surveiller=()):
+        # surveiller : objets Call / Operator dont le hash est surveillé par WATCH
+        self.surveiller = list(surveiller)
+        self.pipeline = None
+        self._externe = False
+
+    def __enter__(self):
+        # Une session ouverte dans une autre session rejoint la session englobante
+        if getattr(_local, "session", None) is not None:
+            # WATCH n'est plus possible une fois le MULTI de la session englobante commencé
+            if self.surveiller:
+                raise Exception("Impossible de surveiller des clés dans une session déjà ouverte.")
+            self._externe = True
+            return _local.session
+
+        self.pipeline = get_connexion().pipeline(transaction=True)
+        if self.surveiller:
+            # WATCH passe le pipeline en mode immédiat, MULTI repasse en mode mis en attente
+            self.pipeline.watch(*self._cles())
+            self.pipeline.multi()
+        _local.session = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._externe:
+            return False
+
+        _local.session = None
+        cles = cles_suivies(self.pipeline)
+        try:
+            if exc_type is None:
+                self.pipeline.execute()
+        finally:
+            self.pipeline.reset()
+            # Le cache local ne doit pas resservir l'état d'avant ces écritures
+            invalider_local(cles)
+        return False
+
+    def _cles(self):
+        return [objet.cle(objet._id) for objet in self.surveiller]
+
+
+def session_active():
+    """
+    Retourne la session ouverte dans le thread courant, ou None
+    """
+    return getattr(_local, "session", None)
+
+
+@contextmanager
+def ecriture():
+    """
+    Fournit le pipeline où les setters ajoutent leurs écritures :
+    celui de la session active, ou un MULTI/EXEC exécuté immédiatement
+    """
+    session = session_active()
+    if session is not None:
+        yield session.pipeline
+        return
+
+    pipeline = get_connexion().pipeline(transaction=True)
+    yield pipeline
+    cles = cles_suivies(pipeline)
+    try:
+        pipeline.execute()
+    finally:
+        invalider_local(cles)
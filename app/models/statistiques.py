@@ -0,0 +1,118 @@
+"""
+Statistiques des appels tenues à jour dans Redis à chaque changement d'état,
+dans la même transaction (ou le même script Lua) que le changement :
+
+    statistiques_appels              hash des totaux depuis le début
+    statistiques_appels :{minute}    même hash par minute (minute = début en secondes depuis epoch),
+                                     expire après RETENTION_STATISTIQUES secondes
+    statistiques_operateurs          hash "{id}:appels" et "{id}:duree" par opérateur
+
+Champs : crees (création d'un appel), affectes et attente_totale (affectation par le
+coordinateur ou Operator.call_id, attente depuis la création), termines et duree_totale
+(Call.end() ou Call.archiver_termines(), durée depuis l'affectation), abandonnes
+(appel terminé sans avoir été affecté).
+
+Les lectures ne parcourent jamais les appels : HGETALL sur les totaux,
+un HGETALL par minute demandée, en un seul aller-retour.
+"""
+import time
+
+from .connexion import get_connexion
+
+CLE_STATISTIQUES = "statistiques_appels"
+CLE_STATISTIQUES_OPERATEURS = "statistiques_operateurs"
+
+# Les compteurs par minute sont gardés deux jours
+RETENTION_STATISTIQUES = 2 * 24 * 3600
+
+# Fonctions Lua communes aux scripts d'affectation et de fin d'appel.
+# La clé de la minute est passée dans KEYS par le client (cle_minute, horloge du client)
+LUA_STATISTIQUES = """
+local function horloge()
+    local temps = redis.call('TIME')
+    return tonumber(temps[1]) + tonumber(temps[2]) / 1000000
+end
+
+local function compter(cle_totaux, cle_minute, compteur, champ_duree, duree)
+    for _, cle in ipairs({cle_totaux, cle_minute}) do
+        redis.call('HINCRBY', cle, compteur, 1)
+        if champ_duree then redis.call('HINCRBYFLOAT', cle, champ_duree, duree) end
+    end
+    redis.call('EXPIRE', cle_minute, $retention)
+end
+"""
+
+
+def cle_minute(horodatage):
+    """
+    Retourne la clé des statistiques de la minute contenant horodatage (secondes depuis epoch)
+    """
+    seconde = int(horodatage)
+    return "{} :{}".format(CLE_STATISTIQUES, seconde - seconde % 60)
+
+
+def compter_creation(pipeline, horodatage):
+    """
+    Ajoute au pipeline le comptage de la création d'un appel
+    """
+    for cle in (CLE_STATISTIQUES, cle_minute(horodatage)):
+        pipeline.hincrby(cle, "crees", 1)
+    pipeline.expire(cle_minute(horodatage), RETENTION_STATISTIQUES)
+
+
+def _typer(statistiques):
+    # Compteurs en entiers, sommes en secondes, et moyennes calculées
+    resultat = {
+        compteur: int(statistiques.get(compteur, 0))
+        for compteur in ("crees", "affectes", "termines", "abandonnes")
+    }
+    resultat["attente_totale"] = float(statistiques.get("attente_totale", 0))
+    resultat["duree_totale"] = float(statistiques.get("duree_totale", 0))
+    resultat["attente_moyenne"] = (
+        resultat["attente_totale"] / resultat["affectes"] if resultat["affectes"] else None
+    )
+    resultat["duree_moyenne"] = (
+        resultat["duree_totale"] / resultat["termines"] if resultat["termines"] else None
+    )
+    return resultat
+
+
+def statistiques_appels(minutes=60, maintenant=None):
+    """
+    Retourne les totaux depuis le début et les statistiques des minutes dernières minutes
+    (clé : début de la minute en secondes depuis epoch, de la plus ancienne à la plus récente)
+    """
+    maintenant = time.time() if maintenant is None else maintenant
+    debuts = [int(maintenant) - int(maintenant) % 60 - 60 * rang for rang in reversed(range(minutes))]
+
+    pipeline = get_connexion().pipeline(transaction=False)
+    pipeline.hgetall(CLE_STATISTIQUES)
+    for debut in debuts:
+        pipeline.hgetall(cle_minute(debut))
+    total, *par_minute = pipeline.execute()
+
+    return {
+        "total": _typer(total),
+        "par_minute": {debut: _typer(statistiques) for debut, statistiques in zip(debuts, par_minute)},
+    }
+
+
+def statistiques_operateurs():
+    """
+    Retourne pour chaque opérateur le nombre d'appels terminés et leur durée totale (secondes)
+    """
+    resultat = {}
+    for champ, valeur in get_connexion().hgetall(CLE_STATISTIQUES_OPERATEURS).items():
+        identifiant, compteur = champ.rsplit(":", 1)
+        statistiques = resultat.setdefault(identifiant, {"appels": 0, "duree": 0.0})
+        statistiques[compteur] = int(valeur) if compteur == "appels" else float(valeur)
+    return resultat
+
+
+def reinitialiser_statistiques():
+    """
+    Supprime toutes les statistiques (totaux, minutes, opérateurs)
+    """
+    cles = [CLE_STATISTIQUES, CLE_STATISTIQUES_OPERATEURS]
+    cles += list(get_connexion().scan_iter(match="{} :*".format(CLE_STATISTIQUES)))
+    get_connexion().unlink(*cles)
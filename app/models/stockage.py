@@ -0,0 +1,138 @@
+"""
+Disposition des hashs des appels dans Redis.
+
+Deux dispositions, choisies par REDIS_STOCKAGE_COMPACT (0 ou 1) ou configure_stockage() :
+
+    classique (par défaut)   clé "appels_entrants :{id}", champs creation_time, phone_number,
+                             status, operator_id, description, priority, queue, assign_time ;
+                             creation_time au format "%m/%d/%Y, %H:%M:%S"
+    compacte                 clé "ap:{id}", champs t, n, s, o, d, p, q, a ;
+                             t en secondes depuis epoch (entier), description, priorité
+                             et file par défaut non enregistrées
+
+Les hashs compacts restent petits (noms et valeurs courts) : Redis les garde en listpack
+tant qu'ils respectent hash-max-listpack-entries / hash-max-listpack-value.
+Les modèles ne manipulent que les noms classiques : encoder_appel() et decoder_appel()
+font la conversion, champ() donne le nom enregistré d'un champ.
+Tous les processus doivent utiliser la même disposition : pour changer de disposition
+sur une base existante, voir migrer_stockage() (python -m app.migrer_stockage).
+
+Chaque file d'attente peut aussi être découpée en partitions, choisies par
+REDIS_PARTITIONS_ATTENTE ou configure_partitions() : l'appel id va dans la partition
+id % nombre_partitions() (voir Call.cle_attente et repartition.py). Avec une seule
+partition (par défaut) les clés des files ne changent pas. Pour changer le nombre de
+partitions d'une base existante : arrêter les coordinateurs puis Coordinator.reconstruire_files().
+"""
+import os
+from datetime import datetime
+
+FORMAT_CREATION = "%m/%d/%Y, %H:%M:%S"
+
+PREFIXE_CLASSIQUE = "appels_entrants :"
+PREFIXE_COMPACT = "ap:"
+
+CHAMPS_COMPACTS = {
+    "creation_time": "t",
+    "phone_number": "n",
+    "status": "s",
+    "operator_id": "o",
+    "description": "d",
+    "priority": "p",
+    "queue": "q",
+    "assign_time": "a",
+}
+CHAMPS_CLASSIQUES = {court: nom for nom, court in CHAMPS_COMPACTS.items()}
+
+# Valeurs non enregistrées dans la disposition compacte
+DEFAUTS_COMPACTS = {"description": " ", "priority": 0, "queue": ""}
+
+_compact = None
+_partitions = None
+
+
+def configure_stockage(compact):
+    """
+    Choisit la disposition des hashs des appels pour ce processus
+    """
+    global _compact
+    _compact = bool(compact)
+
+
+def compact():
+    """
+    Retourne True si la disposition compacte est utilisée
+    """
+    if _compact is None:
+        return os.environ.get("REDIS_STOCKAGE_COMPACT", "0") == "1"
+    return _compact
+
+
+def configure_partitions(nombre):
+    """
+    Choisit le nombre de partitions de chaque file d'attente pour ce processus
+    """
+    global _partitions
+    if int(nombre) < 1:
+        raise Exception("Le nombre de partitions doit être au moins 1.")
+    _partitions = int(nombre)
+
+
+def nombre_partitions():
+    """
+    Retourne le nombre de partitions de chaque file d'attente
+    """
+    if _partitions is None:
+        return max(1, int(os.environ.get("REDIS_PARTITIONS_ATTENTE", "1")))
+    return _partitions
+
+
+def cle_appel(identifiant, compacte=None):
+    """
+    Retourne la clé du hash d'un appel dans la disposition courante (ou celle demandée)
+    """
+    compacte = compact() if compacte is None else compacte
+    return "{}{}".format(PREFIXE_COMPACT if compacte else PREFIXE_CLASSIQUE, identifiant)
+
+
+def champ(nom, compacte=None):
+    """
+    Retourne le nom enregistré du champ nom dans la disposition courante (ou celle demandée)
+    """
+    compacte = compact() if compacte is None else compacte
+    return CHAMPS_COMPACTS[nom] if compacte else nom
+
+
+def encoder_appel(details_appel, compacte=None):
+    """
+    Convertit les champs d'un appel (noms classiques) en mapping à enregistrer dans le hash
+    """
+    compacte = compact() if compacte is None else compacte
+    if not compacte:
+        return dict(details_appel)
+
+    mapping = {}
+    for nom, valeur in details_appel.items():
+        if nom in DEFAUTS_COMPACTS and valeur == DEFAUTS_COMPACTS[nom]:
+            continue
+        if nom == "creation_time":
+            if not isinstance(valeur, datetime):
+                valeur = datetime.strptime(valeur, FORMAT_CREATION)
+            valeur = int(valeur.timestamp())
+        mapping[CHAMPS_COMPACTS.get(nom, nom)] = valeur
+    return mapping
+
+
+def decoder_appel(details_appel):
+    """
+    Convertit un hash d'appel lu dans Redis (ou une entrée de l'archive),
+    quelle que soit sa disposition, en champs aux noms classiques
+    """
+    if "creation_time" in details_appel or not details_appel:
+        return details_appel
+
+    resultat = {nom: valeur for nom, valeur in DEFAUTS_COMPACTS.items()}
+    for nom, valeur in details_appel.items():
+        resultat[CHAMPS_CLASSIQUES.get(nom, nom)] = valeur
+    if "creation_time" in resultat:
+        resultat["creation_time"] = datetime.fromtimestamp(int(resultat["creation_time"])).strftime(FORMAT_CREATION)
+    return resultat
@@ -0,0 +1,189 @@
+"""
+Simulation de charge du centre d'appels : des appels arrivent, le vrai Coordinator les affecte
+aux opérateurs, les appels se terminent (Call.end()), seconde simulée par seconde simulée.
+
+    python -m app.simulation --appels 10000 --operateurs 200 --arrivees 5 --duree-appel 60
+    python -m app.simulation --files anglais,espagnol --redis
+
+Par défaut la simulation tourne sur le backend en mémoire (REDIS_BACKEND=memoire, voir
+app/models/connexion.py) : pas de redis-server ni de réseau, la base part de zéro.
+Avec --redis, elle utilise le redis-server configuré (REDIS_HOST, ...) et supprime tous
+les appels et opérateurs : à lancer sur une base de test (REDIS_DB).
+
+Chaque seconde simulée : arrivée de --arrivees appels (dans une file tirée au hasard parmi
+la file par défaut et --files), fin des appels dont la durée (exponentielle de moyenne
+--duree-appel secondes) est écoulée, puis Coordinator.assign_all(). Les attentes sont
+mesurées en secondes simulées ; le résultat, en JSON, donne aussi le débit réel.
+
+Coordinator.assign_file envoie les affectations par lots, mais chacune reste un script Lua :
+sur le backend en mémoire, c'est l'interpréteur Lua de fakeredis qui limite le débit réel
+(environ 200 appels par seconde réelle, création, affectation et fin comprises).
+Pour des millions d'appels, utiliser --redis sur un vrai redis-server.
+"""
+import argparse
+import json
+import random
+import time
+
+from app.models import (
+    Call, Coordinator, Operator, charger_scripts, configure, get_connexion, reinitialiser_statistiques,
+    statistiques_appels,
+)
+
+
+def repartir_operateurs(nombre, files):
+    """
+    Répartit nombre opérateurs à parts égales entre : sans groupe, et un groupe par file.
+    Retourne les couples (skills, numéros des opérateurs)
+    """
+    groupes = [[]] + [[file] for file in files]
+    return [(skills, range(rang, nombre, len(groupes))) for rang, skills in enumerate(groupes)]
+
+
+class CentreRedis:
+    """
+    Centre d'appels sur les modèles : Call, Operator et Coordinator
+    """
+
+    def __init__(self, nombre_operateurs, files):
+        self.appels = {}
+        for skills, numeros in repartir_operateurs(nombre_operateurs, files):
+            Operator.create_many([("Prenom{}".format(numero), "Nom{}".format(numero)) for numero in numeros], skills=skills)
+
+    def arriver(self, file, numeros):
+        """
+        Crée les appels en attente dans la file, retourne leurs identifiants
+        """
+        identifiants = []
+        for appel in Call.create_many(["06{:08d}".format(numero) for numero in numeros], queue=file):
+            self.appels[str(appel._id)] = appel
+            identifiants.append(str(appel._id))
+        return identifiants
+
+    def terminer(self, identifiants):
+        for appel_id in identifiants:
+            self.appels.pop(appel_id).end()
+
+    def affecter(self):
+        """
+        Retourne les couples (id appel, id opérateur) affectés
+        """
+        return [(appel_id, operateur_id) for appel_id, operateur_id, _ in Coordinator.assign_all()]
+
+
+def centile(valeurs, proportion):
+    if not valeurs:
+        return None
+    return valeurs[min(len(valeurs) - 1, int(len(valeurs) * proportion))]
+
+
+def simuler(centre, nombre_appels, arrivees, duree_appel, files):
+    """
+    Déroule la simulation sur centre (CentreRedis) jusqu'à ce que tous
+    les appels soient terminés, retourne le résumé des attentes, des profondeurs de file et des volumes
+    """
+    arrivee = {}
+    # Seconde de fin -> identifiants des appels qui se terminent
+    fins = {}
+    attentes = []
+    profondeur_max = 0
+    crees = 0
+    affectes = 0
+    termines = 0
+    seconde = 0
+    choix_files = [""] + files
+    expovariate, taux = random.expovariate, 1 / duree_appel
+
+    while termines < nombre_appels:
+        # Arrivées de la seconde, regroupées par file : un create_many par file
+        nouveaux = min(arrivees, nombre_appels - crees)
+        par_file = {}
+        for numero, file in zip(range(crees, crees + nouveaux), random.choices(choix_files, k=nouveaux)):
+            par_file.setdefault(file, []).append(numero)
+        for file, numeros in par_file.items():
+            for appel_id in centre.arriver(file, numeros):
+                arrivee[appel_id] = seconde
+        crees += nouveaux
+
+        # Fins des appels dont la durée est écoulée : l'opérateur est libéré
+        finis = fins.pop(seconde, [])
+        centre.terminer(finis)
+        termines += len(finis)
+
+        affectations = centre.affecter()
+        for appel_id, _ in affectations:
+            attentes.append(seconde - arrivee.pop(appel_id))
+            fins.setdefault(seconde + max(1, round(expovariate(taux))), []).append(appel_id)
+        affectes += len(affectations)
+
+        # Les appels ne quittent la file d'attente que par une affectation
+        profondeur_max = max(profondeur_max, crees - affectes)
+        seconde += 1
+
+    attentes.sort()
+    return {
+        "secondes_simulees": seconde,
+        "appels": crees,
+        "attente_moyenne": sum(attentes) / len(attentes) if attentes else None,
+        "attente_p50": centile(attentes, 0.5),
+        "attente_p99": centile(attentes, 0.99),
+        "attente_max": attentes[-1] if attentes else None,
+        "profondeur_max": profondeur_max,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulation de charge du centre d'appels")
+    parser.add_argument("--appels", type=int, default=10000, help="nombre total d'appels simulés")
+    parser.add_argument("--operateurs", type=int, default=100, help="nombre d'opérateurs")
+    parser.add_argument("--arrivees", type=int, default=50, help="appels arrivant par seconde simulée")
+    parser.add_argument("--duree-appel", type=float, default=60.0, help="durée moyenne d'un appel (secondes simulées)")
+    parser.add_argument("--files", default="", help="files nommées, séparées par des virgules")
+    parser.add_argument("--graine", type=int, help="graine du générateur aléatoire (simulation reproductible)")
+    parser.add_argument("--redis", action="store_true", help="utiliser le redis-server configuré au lieu du backend en mémoire")
+    parser.add_argument("--sortie", help="fichier JSON du résultat (sortie standard par défaut)")
+    arguments = parser.parse_args()
+
+    random.seed(arguments.graine)
+    files = [file for file in arguments.files.split(",") if file]
+
+    if not arguments.redis:
+        configure(backend="memoire")
+    charger_scripts(get_connexion())
+    Call.destroy_all()
+    Operator.destroy_all()
+    reinitialiser_statistiques()
+
+    debut = time.perf_counter()
+    try:
+        resultat = simuler(CentreRedis(arguments.operateurs, files), arguments.appels, arguments.arrivees, arguments.duree_appel, files)
+    finally:
+        Call.destroy_all()
+        Operator.destroy_all()
+    duree_reelle = time.perf_counter() - debut
+    resultat["statistiques"] = statistiques_appels(minutes=0)["total"]
+
+    resultat["duree_reelle"] = duree_reelle
+    resultat["appels_par_seconde_reelle"] = resultat["appels"] / duree_reelle
+    resultat = json.dumps({
+        "backend": "redis" if arguments.redis else "memoire",
+        "parametres": {
+            "appels": arguments.appels,
+            "operateurs": arguments.operateurs,
+            "arrivees": arguments.arrivees,
+            "duree_appel": arguments.duree_appel,
+            "files": files,
+            "graine": arguments.graine,
+        },
+        "resultat": resultat,
+    }, indent=2)
+
+    if arguments.sortie:
+        with open(arguments.sortie, "w") as fichier:
+            fichier.write(resultat + "\n")
+    else:
+        print(resultat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import pytest
+
+from app.models import (
+    charger_scripts, configure, configure_partitions, configure_stockage, desactiver_cache,
+    get_connexion, reinitialiser_memoire,
+)
+
+
+@pytest.fixture(autouse=True)
+def memoire():
+    """
+    Chaque test part d'un serveur en mémoire vide (backend "memoire"),
+    disposition classique et une seule partition par file
+    """
+    configure(backend="memoire")
+    reinitialiser_memoire()
+    configure_stockage(False)
+    configure_partitions(1)
+    desactiver_cache()
+    charger_scripts(get_connexion())
+    yield get_connexion()
+    configure_partitions(1)
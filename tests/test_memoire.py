@@ -0,0 +1,160 @@
+"""
+Tests des modèles sur le backend en mémoire (configure(backend="memoire"), voir conftest.py)
+"""
+import pytest
+from redis.exceptions import WatchError
+
+from app.models import (
+    AffectationImpossible, Call, Coordinator, Operator, Session, configure_partitions, get_connexion,
+    statistiques_appels,
+)
+
+
+def servir_un_par_un(nombre):
+    # Un opérateur libre à la fois : l'ordre des affectations est l'ordre de service
+    ordre = []
+    for numero in range(nombre):
+        Operator("Prenom{}".format(numero), "Nom{}".format(numero))
+        ordre += [appel_id for appel_id, _, _ in Coordinator.assign_all()]
+    return ordre
+
+
+def test_affectation():
+    appel = Call("0600000001")
+    operateur = Operator("Jean", "Dupont")
+
+    affectations = Coordinator.assign_all()
+
+    assert [(appel_id, operateur_id) for appel_id, operateur_id, _ in affectations] == [(str(appel._id), str(operateur._id))]
+    assert Call.data_by_id(appel._id)["status"] == 1
+    assert Call.data_by_id(appel._id)["operator_id"] == operateur._id
+    assert Operator.get_instance_by_id(operateur._id).call_id == appel._id
+    assert Call.compter_par_status() == {0: 0, 1: 1, 2: 0}
+    assert Operator.available() == []
+
+
+def test_affectation_sans_operateur():
+    Call("0600000001")
+
+    assert Coordinator.assign_all() == []
+    assert Call.compter_par_status() == {0: 1, 1: 0, 2: 0}
+
+
+def test_affectation_par_call_id():
+    appel = Call("0600000001")
+    operateur = Operator("Jean", "Dupont")
+    operateur.call_id = appel._id
+
+    assert Call.data_by_id(appel._id)["status"] == 1
+    with pytest.raises(AffectationImpossible):
+        Operator("Marie", "Martin").call_id = appel._id
+
+
+def test_fin_et_archive():
+    appel = Call("0600000001")
+    operateur = Operator("Jean", "Dupont")
+    Coordinator.assign_all()
+
+    appel.end()
+
+    assert not get_connexion().exists(Call.cle(appel._id))
+    assert Call.compter_par_status() == {0: 0, 1: 0, 2: 0}
+    assert [details["id"] for details in Operator.available()] == [str(operateur._id)]
+    archive = Call.archive()
+    assert [(details["id"], details["status"]) for details in archive] == [(str(appel._id), 2)]
+    assert statistiques_appels(minutes=0)["total"]["termines"] == 1
+
+
+def test_archiver_termines():
+    appel = Call("0600000001")
+    appel.status = 2
+
+    assert Call.archiver_termines() == 1
+    assert [details["id"] for details in Call.archive()] == [str(appel._id)]
+    assert Call.compter_par_status() == {0: 0, 1: 0, 2: 0}
+
+
+def test_ordre_des_priorites():
+    appels = [Call("06000000{:02d}".format(numero), priority=priorite) for numero, priorite in enumerate([0, 3, 1, 2])]
+
+    ordre = servir_un_par_un(len(appels))
+
+    assert ordre == [str(appels[rang]._id) for rang in (1, 3, 2, 0)]
+
+
+def test_routage_par_skills():
+    appel_anglais = Call("0600000001", queue="anglais")
+    appel_defaut = Call("0600000002")
+    anglophone = Operator("John", "Smith", skills=["anglais"])
+
+    # La file nommée passe avant la file par défaut : l'anglophone lui est réservé
+    assert [(appel_id, operateur_id) for appel_id, operateur_id, _ in Coordinator.assign_all()] == [
+        (str(appel_anglais._id), str(anglophone._id)),
+    ]
+
+    # Un opérateur sans groupe ne prend que la file par défaut
+    Call("0600000003", queue="anglais")
+    generaliste = Operator("Jean", "Dupont")
+    assert [(appel_id, operateur_id) for appel_id, operateur_id, _ in Coordinator.assign_all()] == [
+        (str(appel_defaut._id), str(generaliste._id)),
+    ]
+    assert len(Call.waiting(queue="anglais")) == 1
+
+
+def test_ordre_sur_plusieurs_partitions():
+    configure_partitions(2)
+    priorites = [0, 3, 5, 1, 2, 4]
+    appels = [Call("06000000{:02d}".format(numero), priority=priorite) for numero, priorite in enumerate(priorites)]
+    # Les appels sont bien répartis sur les deux partitions
+    assert {Call.partition(appel._id) for appel in appels} == {0, 1}
+
+    ordre = servir_un_par_un(len(appels))
+
+    assert ordre == [str(appel._id) for appel in sorted(appels, key=lambda appel: -appel.priority)]
+
+
+def test_lot_sur_plusieurs_partitions():
+    configure_partitions(2)
+    appels = [Call("06000000{:02d}".format(numero), priority=numero) for numero in range(5)]
+    Operator.create_many([("Prenom{}".format(numero), "Nom{}".format(numero)) for numero in range(3)])
+
+    affectations = Coordinator.assign_all()
+
+    assert [appel_id for appel_id, _, _ in affectations] == [str(appel._id) for appel in appels[:1:-1]]
+    assert len({operateur_id for _, operateur_id, _ in affectations}) == 3
+    assert Call.compter_par_status() == {0: 2, 1: 3, 2: 0}
+
+
+def test_session():
+    appel = Call("0600000001")
+    operateur = Operator("Jean", "Dupont")
+
+    with Session():
+        appel.description = "Réclamation"
+        operateur.skills = ["anglais"]
+        # Rien n'est écrit avant la fin de la session
+        assert Call.data_by_id(appel._id)["description"] != "Réclamation"
+
+    assert Call.data_by_id(appel._id)["description"] == "Réclamation"
+    assert [details["id"] for details in Operator.available(groupe="anglais")] == [str(operateur._id)]
+
+
+def test_session_surveillee_modifiee():
+    appel = Call("0600000001")
+
+    with pytest.raises(WatchError):
+        with Session(surveiller=[appel]):
+            appel.description = "Réclamation"
+            # Un autre client modifie le hash surveillé avant l'EXEC
+            get_connexion().hset(Call.cle(appel._id), "description", "Autre")
+
+    assert Call.data_by_id(appel._id)["description"] == "Autre"
+
+
+def test_session_surveillee():
+    appel = Call("0600000001")
+
+    with appel.batch(surveiller=True):
+        appel.priority = 2
+
+    assert Call.data_by_id(appel._id)["priority"] == 2